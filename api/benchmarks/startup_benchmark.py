@@ -0,0 +1,79 @@
+"""
+Startup benchmark for the API worker roles.
+
+Each scenario runs in a fresh interpreter and reports wall-clock import time,
+peak RSS and which heavy ingestion modules ended up in sys.modules:
+
+- query:  RAPT_ROLE=query, i.e. a chat-serving worker.
+- ingest: ingest_worker, before any document has been indexed.
+- eager:  the previous behaviour, importing main plus the whole OCR/NLP stack.
+
+Run from the api directory:
+
+    python benchmarks/startup_benchmark.py --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["easyocr", "torch", "spacy",
+                 "pytesseract", "pdf2image", "PyPDF2", "pypdfium2"]
+
+SCENARIOS = {
+    "query": "import main",
+    "ingest": "import ingest_worker",
+    "eager": "import main\n" + "\n".join(
+        f"import {name}" for name in HEAVY_MODULES if name != "torch"),
+}
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+{body}
+elapsed = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform != "darwin":
+    rss *= 1024  # ru_maxrss is KiB on Linux, bytes on macOS
+print(json.dumps({{
+    "seconds": elapsed,
+    "rss_bytes": rss,
+    "heavy": sorted(m for m in {heavy!r} if m in sys.modules),
+}}))
+"""
+
+
+def run_scenario(name: str, role: str) -> dict:
+    env = dict(os.environ)
+    env["RAPT_ROLE"] = role
+    # Module import must not depend on real credentials.
+    env.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    code = PROBE.format(body=SCENARIOS[name], heavy=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, "-c", code], cwd=API_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS))
+    args = parser.parse_args()
+
+    print(f"{'scenario':<8} {'median s':>9} {'max s':>7} {'peak RSS MiB':>13}  heavy modules")
+    for name in args.scenarios:
+        role = "all" if name == "eager" else name
+        runs = [run_scenario(name, role) for _ in range(args.repeat)]
+        seconds = [run["seconds"] for run in runs]
+        rss = max(run["rss_bytes"] for run in runs) / (1024 * 1024)
+        heavy = ", ".join(runs[-1]["heavy"]) or "-"
+        print(f"{name:<8} {statistics.median(seconds):>9.3f} {max(seconds):>7.3f} "
+              f"{rss:>13.1f}  {heavy}")
+
+
+if __name__ == "__main__":
+    main()
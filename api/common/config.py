@@ -1,11 +1,16 @@
 
 import os
+from functools import lru_cache
 from pinecone import Pinecone, ServerlessSpec
 from openai import OpenAI
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Which endpoints a worker serves: "query" (chat only), "ingest" (document
+# indexing only) or "all".
+SERVICE_ROLES = ("all", "query", "ingest")
+
 
 def get_pinecone_index(api_key=None):
     if api_key is None:
@@ -13,6 +18,13 @@ def get_pinecone_index(api_key=None):
         if api_key is None:
             raise ValueError("API key is required")
 
+    return _connect_pinecone_index(api_key)
+
+
+@lru_cache(maxsize=None)
+def _connect_pinecone_index(api_key):
+    # Cached per API key: the index handle is thread-safe and reused by every
+    # query and upsert batch instead of listing indexes on each call.
     try:
         # Initialize Pinecone client
         pc = Pinecone(
@@ -52,5 +64,15 @@ def get_openai_client(api_key=None):
         raise ValueError("Invalid API key") from e
 
 
+def get_service_role(role=None):
+    if role is None:
+        role = os.environ.get('RAPT_ROLE', 'all')
+    role = role.strip().lower()
+    if role not in SERVICE_ROLES:
+        raise ValueError(
+            f"Invalid service role: {role!r} (expected one of {', '.join(SERVICE_ROLES)})")
+    return role
+
+
 # Export the functions
-__all__ = ['get_pinecone_index', 'get_openai_client']
+__all__ = ['get_pinecone_index', 'get_openai_client', 'get_service_role']
@@ -0,0 +1,78 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, wait
+from typing import Any, Callable, Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a stage runs out of its share of the request deadline."""
+    pass
+
+
+class Deadline:
+    """An absolute point in time (monotonic clock) a request must finish by."""
+
+    def __init__(self, seconds: float):
+        self.total = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def budget(self, fraction: float, reserve: float = 0.0) -> float:
+        """
+        Seconds a stage may use: `fraction` of the total deadline, capped by
+        what is left after keeping `reserve` seconds for later stages.
+        """
+        return max(min(self.total * fraction, self.remaining() - reserve), 0.0)
+
+    def check(self, stage: str) -> None:
+        if self.expired:
+            raise DeadlineExceeded(f"Deadline exceeded before {stage}")
+
+
+def hedged_call(executor: Executor, fn: Callable[[], Any], timeout: float,
+                hedge_after: float, max_attempts: int = 2) -> Any:
+    """
+    Runs fn, starting a duplicate attempt each time `hedge_after` seconds
+    pass without a result (up to `max_attempts` in flight), and returns the
+    first successful result. A failed attempt is replaced right away while
+    time remains. Attempts still running at the end are abandoned; they
+    can't be cancelled, so fn should bound its own run time (e.g. with a
+    request timeout) to give the executor's workers back.
+
+    Raises DeadlineExceeded after `timeout` seconds, or the last error if
+    every attempt failed.
+    """
+    expires_at = time.monotonic() + timeout
+    pending = {executor.submit(fn)}
+    attempts = 1
+    last_error: Optional[BaseException] = None
+    while True:
+        remaining = expires_at - time.monotonic()
+        if remaining <= 0:
+            break
+        can_hedge = attempts < max_attempts
+        done, pending = wait(pending, timeout=min(hedge_after, remaining) if can_hedge else remaining,
+                             return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for other in pending:
+                    other.cancel()
+                return future.result()
+            last_error = future.exception()
+        if can_hedge and (not done or not pending):
+            # Either nothing came back within the hedge delay, or every
+            # attempt so far failed: start another.
+            pending.add(executor.submit(fn))
+            attempts += 1
+        elif not pending:
+            break
+    for future in pending:
+        future.cancel()
+    if last_error is not None and not pending:
+        raise last_error
+    raise DeadlineExceeded(f"No result within {timeout:.2f}s")
@@ -0,0 +1,34 @@
+import math
+from typing import Dict, Optional
+
+# Log-spaced latency buckets: bucket i holds latencies up to
+# LATENCY_BASE_MS * LATENCY_GROWTH ** i, so percentiles read back from
+# bucket counts are within 10% of the true value.
+LATENCY_BASE_MS = 1.0
+LATENCY_GROWTH = 1.1
+LATENCY_BUCKETS = 160  # the last bucket tops out above two hours
+
+
+def latency_bucket(latency_ms: float) -> int:
+    if latency_ms <= LATENCY_BASE_MS:
+        return 0
+    bucket = math.ceil(math.log(latency_ms / LATENCY_BASE_MS, LATENCY_GROWTH))
+    return min(bucket, LATENCY_BUCKETS - 1)
+
+
+def bucket_upper_bound(bucket: int) -> float:
+    return LATENCY_BASE_MS * LATENCY_GROWTH ** bucket
+
+
+def percentile(counts: Dict[int, int], q: float) -> Optional[float]:
+    """Estimate the q-th percentile (0-100) from bucket counts."""
+    total = sum(counts.values())
+    if not total:
+        return None
+    rank = max(1, math.ceil(total * q / 100))
+    seen = 0
+    for bucket in sorted(counts):
+        seen += counts[bucket]
+        if seen >= rank:
+            return round(bucket_upper_bound(bucket), 2)
+    return round(bucket_upper_bound(max(counts)), 2)
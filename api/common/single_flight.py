@@ -0,0 +1,64 @@
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+from common.deadline import DeadlineExceeded
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one upstream call.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait for and share its result (or exception). Nothing is
+    cached: once the call finishes the key is forgotten, so later callers
+    always trigger a fresh call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args,
+           timeout: Optional[float] = None,
+           rerun_shared: Optional[Callable[[Any, Optional[BaseException]], bool]] = None,
+           **kwargs) -> Tuple[Any, bool]:
+        """
+        Returns (result, shared); shared is True if another caller ran fn.
+
+        A caller waiting on another's call gives up with DeadlineExceeded
+        after `timeout` seconds; the caller running fn bounds it itself. If
+        `rerun_shared(result, error)` is true for the outcome of another's
+        call, the waiting caller runs fn with its own arguments instead, e.g.
+        when that call ran under a shorter deadline than the waiting caller's.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise DeadlineExceeded("Timed out waiting for a coalesced call")
+            if rerun_shared is not None and rerun_shared(call.result, call.error):
+                return fn(*args, **kwargs), False
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
@@ -1,46 +1,318 @@
+import os
+from collections import defaultdict
 from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
 from fastapi import FastAPI
+from sqlalchemy import Index, func, inspect, literal, select, text
+from sqlalchemy.dialects.sqlite import insert
 from sqlmodel import Field, Session, SQLModel, create_engine
+from common.latency_histogram import latency_bucket, percentile
 
 sqlite_file_name = "test.db"
 sqlite_url = f"sqlite:///{sqlite_file_name}"
 
 connect_args = {"check_same_thread": False}
-engine = create_engine(sqlite_url, connect_args=connect_args)
+engine = create_engine(sqlite_url, echo=os.environ.get("DATABASE_ECHO") == "1",
+                       connect_args=connect_args)
+
+# Rollup rows use ALL for the dimension they aggregate over, e.g. the row for
+# (model="gpt-4o", session_id=ALL) covers every session using gpt-4o.
+ALL = "*"
+UNKNOWN = "unknown"
+GRANULARITIES = ("hour", "day")
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
 
 
 class Usage(SQLModel, table=True):
-    id: int | None = Field(default=None, primary_key=True)
+    __table_args__ = (
+        Index("ix_usage_model_created_at", "model", "created_at"),
+        Index("ix_usage_session_id_created_at", "session_id", "created_at"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    created_at: datetime = Field(default_factory=utcnow, index=True)
+    session_id: Optional[str] = None
+    model: Optional[str] = None
     prompt: str
-    temperature: str
-    stop: str
+    temperature: float
+    stop: Optional[str] = None
     is_openai: bool
     response: str
-    input_tokens: str
-    output_tokens: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+    latency_ms: Optional[float] = None
+    cost_usd: float = 0.0
+    # True when the answer was shared from a concurrent identical request, so
+    # no upstream call (and no cost) is attributed to this row.
+    coalesced: bool = False
 
 
-sqlite_file_name = "test.db"
-sqlite_url = f"sqlite:///{sqlite_file_name}"
+class UsageRollup(SQLModel, table=True):
+    """Usage totals per time bucket, maintained as usage rows are written."""
+    __tablename__ = "usage_rollup"
 
-connect_args = {"check_same_thread": False}
-engine = create_engine(sqlite_url, echo=True, connect_args={
-                       "check_same_thread": False})
+    granularity: str = Field(primary_key=True)
+    bucket_start: datetime = Field(primary_key=True)
+    model: str = Field(primary_key=True)
+    session_id: str = Field(primary_key=True)
+    requests: int = 0
+    upstream_requests: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cost_usd: float = 0.0
+    latency_ms_sum: float = 0.0
+    latency_count: int = 0
+
+
+class UsageLatencyRollup(SQLModel, table=True):
+    """Latency histogram (see common.latency_histogram) per rollup row."""
+    __tablename__ = "usage_latency_rollup"
+
+    granularity: str = Field(primary_key=True)
+    bucket_start: datetime = Field(primary_key=True)
+    model: str = Field(primary_key=True)
+    session_id: str = Field(primary_key=True)
+    latency_bucket: int = Field(primary_key=True)
+    count: int = 0
+
+
+def _as_utc(moment: datetime) -> datetime:
+    """Aware UTC datetime; naive datetimes are taken to be UTC already."""
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Invalid granularity: {granularity!r}")
+
+
+def _rollup_keys(usage: Usage) -> Iterator[Tuple[str, datetime, str, str]]:
+    model = usage.model or UNKNOWN
+    session_id = usage.session_id or UNKNOWN
+    for granularity in GRANULARITIES:
+        start = bucket_start(_as_utc(usage.created_at), granularity)
+        for dimensions in ((model, ALL), (ALL, session_id), (ALL, ALL)):
+            yield (granularity, start) + dimensions
+
+
+def _rollup_increments(usage: Usage) -> Dict[str, float]:
+    has_latency = usage.latency_ms is not None
+    return {
+        "requests": 1,
+        "upstream_requests": 0 if usage.coalesced else 1,
+        "input_tokens": usage.input_tokens,
+        "output_tokens": usage.output_tokens,
+        "cost_usd": usage.cost_usd,
+        "latency_ms_sum": usage.latency_ms if has_latency else 0.0,
+        "latency_count": 1 if has_latency else 0,
+    }
+
+
+def _upsert_rollups(session: Session, rollups: Dict[tuple, Dict[str, float]],
+                    latencies: Dict[tuple, int]) -> None:
+    """Adds the given increments to the rollup tables in one statement each."""
+    if rollups:
+        rows = [dict(zip(("granularity", "bucket_start", "model", "session_id"), key), **values)
+                for key, values in rollups.items()]
+        statement = insert(UsageRollup).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=["granularity", "bucket_start", "model", "session_id"],
+            set_={column: getattr(UsageRollup, column) + getattr(statement.excluded, column)
+                  for column in rows[0] if column not in
+                  ("granularity", "bucket_start", "model", "session_id")},
+        )
+        session.exec(statement)
+    if latencies:
+        rows = [dict(zip(("granularity", "bucket_start", "model", "session_id", "latency_bucket"), key),
+                     count=count)
+                for key, count in latencies.items()]
+        statement = insert(UsageLatencyRollup).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=["granularity", "bucket_start", "model",
+                            "session_id", "latency_bucket"],
+            set_={"count": UsageLatencyRollup.count + statement.excluded.count},
+        )
+        session.exec(statement)
+
+
+def _accumulate(usage: Usage, rollups: Dict[tuple, Dict[str, float]],
+                latencies: Dict[tuple, int]) -> None:
+    increments = _rollup_increments(usage)
+    for key in _rollup_keys(usage):
+        totals = rollups.setdefault(key, dict.fromkeys(increments, 0))
+        for column, value in increments.items():
+            totals[column] += value
+        if usage.latency_ms is not None:
+            latencies[key + (latency_bucket(usage.latency_ms),)] += 1
 
 
 def create_db_and_tables():
+    migrate_usage_table()
     SQLModel.metadata.create_all(engine)
 
 
+def migrate_usage_table() -> None:
+    """
+    Migrates the original all-string usage table to the typed schema.
+
+    The old table is kept as usage_legacy. Its rows get the migration time
+    as created_at (they had no timestamp) and the rollups are rebuilt.
+    """
+    inspector = inspect(engine)
+    if "usage" not in inspector.get_table_names():
+        return
+    if "created_at" in {column["name"] for column in inspector.get_columns("usage")}:
+        return
+
+    print("Migrating usage table to the typed schema")
+    # One transaction, so a crash part-way leaves the old table untouched.
+    # pysqlite only opens transactions implicitly before DML, so the ALTER
+    # would otherwise autocommit.
+    with engine.begin() as connection:
+        connection.exec_driver_sql("BEGIN")
+        connection.execute(text("ALTER TABLE usage RENAME TO usage_legacy"))
+        SQLModel.metadata.create_all(connection)
+        # created_at is bound naive, as the ORM stores it, so migrated and new
+        # rows compare alike.
+        connection.execute(text(
+            "INSERT INTO usage (id, created_at, session_id, model, prompt, temperature, stop, "
+            "is_openai, response, input_tokens, output_tokens, latency_ms, cost_usd, coalesced) "
+            "SELECT id, :now, NULL, NULL, prompt, CAST(temperature AS REAL), stop, is_openai, "
+            "response, CAST(input_tokens AS INTEGER), CAST(output_tokens AS INTEGER), NULL, 0, 0 "
+            "FROM usage_legacy"), {"now": utcnow().replace(tzinfo=None)})
+        with Session(bind=connection) as session:
+            _rebuild_rollups(session)
+
+
+def rebuild_rollups(chunk_size: int = 10_000) -> None:
+    """Recomputes the rollup tables from the usage table."""
+    with Session(engine) as session:
+        _rebuild_rollups(session, chunk_size)
+        session.commit()
+
+
+def _rebuild_rollups(session: Session, chunk_size: int = 10_000) -> None:
+    session.exec(UsageRollup.__table__.delete())
+    session.exec(UsageLatencyRollup.__table__.delete())
+    rollups, latencies = {}, defaultdict(int)
+    for usage in session.exec(select(Usage).execution_options(yield_per=chunk_size)).scalars():
+        _accumulate(usage, rollups, latencies)
+    # Chunked to stay under SQLite's bound-parameter limit.
+    rollup_items, latency_items = list(rollups.items()), list(latencies.items())
+    for i in range(0, len(rollup_items), 500):
+        _upsert_rollups(session, dict(rollup_items[i:i + 500]), {})
+    for i in range(0, len(latency_items), 1000):
+        _upsert_rollups(session, {}, dict(latency_items[i:i + 1000]))
+    session.flush()
+
+
 def create_usage(usage: Usage) -> Usage:
     with Session(engine) as session:
         session.add(usage)
+        session.flush()
+        # Rollups are updated in the same transaction with atomic increments,
+        # so they stay consistent with concurrent writers.
+        rollups, latencies = {}, defaultdict(int)
+        _accumulate(usage, rollups, latencies)
+        _upsert_rollups(session, rollups, latencies)
         session.commit()
         session.refresh(usage)
         session.close()
     return usage
 
 
+def summarize_usage(group_by: str, start: datetime, end: datetime, granularity: str,
+                    model: Optional[str] = None, session_id: Optional[str] = None) -> List[dict]:
+    """
+    Aggregates usage from the rollup tables over [start, end).
+
+    group_by is "model", "session", "time" (one group per bucket) or "total".
+    The window is widened to whole buckets of the given granularity. `model`
+    or `session_id` narrow "time" and "total" summaries to one model or session.
+    """
+    start, end = _as_utc(start), _as_utc(end)
+    if model and session_id:
+        raise ValueError("Filter by model or by session_id, not both")
+    if group_by in ("model", "session") and (model or session_id):
+        raise ValueError(f"Filters are not supported when grouping by {group_by}")
+
+    def group_key_and_filters(table):
+        if group_by == "model":
+            return table.model, [table.model != ALL, table.session_id == ALL]
+        if group_by == "session":
+            return table.session_id, [table.model == ALL, table.session_id != ALL]
+        filters = [table.model == (model or ALL), table.session_id == (session_id or ALL)]
+        if group_by == "time":
+            return table.bucket_start, filters
+        if group_by == "total":
+            return None, filters
+        raise ValueError(f"Invalid group_by: {group_by!r}")
+
+    def window(table):
+        return [table.granularity == granularity,
+                table.bucket_start >= bucket_start(start, granularity),
+                table.bucket_start < end]
+
+    key_column, filters = group_key_and_filters(UsageRollup)
+    key_label = (key_column if key_column is not None else literal("all")).label("key")
+    totals_query = (
+        select(key_label,
+               func.sum(UsageRollup.requests), func.sum(UsageRollup.upstream_requests),
+               func.sum(UsageRollup.input_tokens), func.sum(UsageRollup.output_tokens),
+               func.sum(UsageRollup.cost_usd), func.sum(UsageRollup.latency_ms_sum),
+               func.sum(UsageRollup.latency_count))
+        .where(*filters, *window(UsageRollup))
+        .group_by(key_label)
+        .order_by(key_label)
+    )
+
+    key_column, filters = group_key_and_filters(UsageLatencyRollup)
+    key_label = (key_column if key_column is not None else literal("all")).label("key")
+    latency_query = (
+        select(key_label, UsageLatencyRollup.latency_bucket, func.sum(UsageLatencyRollup.count))
+        .where(*filters, *window(UsageLatencyRollup))
+        .group_by(key_label, UsageLatencyRollup.latency_bucket)
+    )
+
+    with Session(engine) as session:
+        histograms = defaultdict(dict)
+        for key, bucket, count in session.exec(latency_query):
+            histograms[key][bucket] = count
+        groups = []
+        for (key, requests, upstream_requests, input_tokens, output_tokens,
+             cost_usd, latency_ms_sum, latency_count) in session.exec(totals_query):
+            histogram = histograms.get(key, {})
+            groups.append({
+                "key": key.isoformat() if isinstance(key, datetime) else key,
+                "requests": requests,
+                "upstream_requests": upstream_requests,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "cost_usd": round(cost_usd, 6),
+                "latency_ms_avg": round(latency_ms_sum / latency_count, 2) if latency_count else None,
+                "latency_ms_p50": percentile(histogram, 50),
+                "latency_ms_p90": percentile(histogram, 90),
+                "latency_ms_p99": percentile(histogram, 99),
+            })
+    return groups
+
+
+def default_usage_window(granularity: str) -> Tuple[datetime, datetime]:
+    """The last 24 hourly buckets or the last 30 daily buckets."""
+    end = utcnow()
+    span = timedelta(hours=24) if granularity == "hour" else timedelta(days=30)
+    return end - span, end
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_db_and_tables()
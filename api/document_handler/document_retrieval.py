@@ -1,50 +1,224 @@
 import os
-from typing import List
-import PyPDF2
+import threading
+from functools import lru_cache, partial
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple, TYPE_CHECKING
 from tenacity import retry, stop_after_attempt, wait_exponential
-from common.config import get_openai_client, get_pinecone_index
-import spacy
-import pytesseract
-from PIL import Image, ImageEnhance, ImageFilter
-from pdf2image import convert_from_path
-import numpy as np
-import easyocr
-import pypdfium2
-from document_handler.exceptions import EmbeddingGenerationError, MetadataValidationError, PDFProcessingError, PineconeUpsertError
+from common.config import get_pinecone_index
+from document_handler.exceptions import EmbeddingGenerationError, MetadataValidationError, PDFProcessingError, PineconeUpsertError, UnsupportedFileTypeError
+from document_handler.ingest_pipeline import IngestPipeline
+from document_handler.models import PageStats
+from document_handler.page_fingerprint import PREVIEW_WIDTH, OCRCache, PageFingerprint, is_blank_page
+from document_handler.query_retrieval import QueryRetrieval
+from document_handler.utils import chunk_paragraphs, split_paragraphs
 from models.metadata import Metadata
 
+# The OCR/NLP stack (easyocr + torch, spaCy, pytesseract, pdf2image, PyPDF2,
+# pypdfium2) is imported inside the methods that use it, so importing this
+# module stays cheap and the models are only loaded on first use.
+if TYPE_CHECKING:
+    from PIL import Image
 
-class DocumentRetrieval:
+TEXT_EXTENSIONS = ('.txt', '.md', '.markdown')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.tif', '.tiff', '.bmp', '.webp')
+SUPPORTED_EXTENSIONS = ('.pdf', '.docx') + TEXT_EXTENSIONS + IMAGE_EXTENSIONS
+# Used when an upload's filename has no supported extension.
+CONTENT_TYPE_EXTENSIONS = {
+    'application/pdf': '.pdf',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': '.docx',
+    'text/plain': '.txt',
+    'text/markdown': '.md',
+    'image/png': '.png',
+    'image/jpeg': '.jpg',
+    'image/gif': '.gif',
+    'image/tiff': '.tiff',
+    'image/bmp': '.bmp',
+    'image/webp': '.webp',
+}
+
+# A PDF page with at least this many non-whitespace characters in its text
+# layer is born-digital and is not OCRed.
+NATIVE_TEXT_MIN_CHARS = 20
+# Chunks per checkpointed pseudo-page for formats without pages.
+TEXT_CHUNKS_PER_PAGE = 50
+
+
+def upload_extension(filename: Optional[str], content_type: Optional[str]) -> str:
+    """
+    Extension to store an upload under: the filename's when it is supported,
+    else one matching the declared content type, so images and text sent
+    without (or with an unusual) extension are still ingested.
+    """
+    extension = os.path.splitext(os.path.basename(filename or ''))[1].lower()
+    if extension in SUPPORTED_EXTENSIONS:
+        return extension
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in CONTENT_TYPE_EXTENSIONS:
+        return CONTENT_TYPE_EXTENSIONS[content_type]
+    if content_type.startswith('image/'):
+        # Pillow detects the image format from the content, not the name
+        return '.png'
+    return extension
+
+
+class DocumentRetrieval(QueryRetrieval):
     def __init__(self):
-        self.nlp = spacy.load("en_core_web_sm")
-        # Initialize EasyOCR reader
-        self.reader = easyocr.Reader(['en'])
+        super().__init__()
+        self._nlp = None
+        self._reader = None
+        # Indexing runs in a threadpool; concurrent first uploads must not
+        # each load the models.
+        self._models_lock = threading.Lock()
+        # Blank pages are skipped and repeated pages (cover and separator
+        # sheets, duplicated scans) reuse earlier OCR results, within and
+        # across documents.
+        self.ocr_dedup = os.environ.get("OCR_DEDUP", "1") != "0"
+        self.ocr_cache = OCRCache(
+            max_entries=int(os.environ.get("OCR_CACHE_SIZE", 1024)))
+
+    @property
+    def nlp(self):
+        if self._nlp is None:
+            with self._models_lock:
+                if self._nlp is None:
+                    import spacy
+                    self._nlp = spacy.load("en_core_web_sm")
+        return self._nlp
 
-    def index_texts(self, file_path: str, metadata: Metadata) -> int:
+    @property
+    def reader(self):
+        if self._reader is None:
+            with self._models_lock:
+                if self._reader is None:
+                    import easyocr
+                    # Initialize EasyOCR reader
+                    self._reader = easyocr.Reader(['en'])
+        return self._reader
+
+    def index_texts(self, file_path: str, metadata: Metadata, stats: Optional[PageStats] = None) -> int:
+        """Indexes the file; per-page text sources are counted into `stats`."""
         try:
-            self.validate_pdf(file_path)
+            self.validate_file(file_path)
             self.validate_metadata(metadata)
-            paragraphs = self.extract_text_with_easyocr(file_path)
-            if not paragraphs:
-                return 0
-            for paragraph in paragraphs:
-                entities = self.perform_ner(paragraph)
-                print(f"Entities in paragraph: {entities}")
-            embeddings = self.generate_embeddings(paragraphs)
-            self.upsert_to_pinecone(paragraphs, embeddings, metadata)
-            return len(paragraphs)
-        except (PDFProcessingError, MetadataValidationError,
+            # Pages stream through embedding and upsert in bounded batches,
+            # checkpointed so an interrupted ingest resumes where it stopped.
+            pipeline = IngestPipeline(self)
+            pages = partial(self.iter_pages, stats=stats or PageStats())
+            return pipeline.run(file_path, metadata, pages)
+        except (PDFProcessingError, UnsupportedFileTypeError, MetadataValidationError,
                 EmbeddingGenerationError, PineconeUpsertError) as e:
             raise e
         except Exception as e:
             raise Exception(f"Unexpected error during indexing: {str(e)}")
 
-    def query_index(self, query, top_k=5):
-        query_embedding = self.generate_embeddings([query])[0]
-        pinecone_index = get_pinecone_index()
-        results = pinecone_index.query(
-            vector=query_embedding, top_k=top_k, include_metadata=True)
-        return results["matches"]
+    def validate_file(self, file_path: str) -> None:
+        if not os.path.exists(file_path):
+            raise PDFProcessingError(f"File not found: {file_path}")
+        extension = os.path.splitext(file_path)[1].lower()
+        if extension not in SUPPORTED_EXTENSIONS:
+            raise UnsupportedFileTypeError(
+                f"Unsupported file type: {extension or file_path}")
+        if extension == '.pdf':
+            self.validate_pdf(file_path)
+
+    def iter_pages(self, file_path: str, start_page: int = 0,
+                   stats: Optional[PageStats] = None) -> Iterator[Tuple[int, List[str]]]:
+        """
+        Yield (page_number, paragraphs) using the cheapest source of text for
+        the format: the text itself for plain text, markdown and docx, the text
+        layer for born-digital PDF pages, and OCR only for images and scanned
+        PDF pages.
+        """
+        stats = stats or PageStats()
+        extension = os.path.splitext(file_path)[1].lower()
+        if extension == '.pdf':
+            return self.iter_pdf_pages(file_path, start_page, stats)
+        if extension in TEXT_EXTENSIONS:
+            return self.iter_text_pages(file_path, start_page, stats)
+        if extension == '.docx':
+            return self.iter_docx_pages(file_path, start_page, stats)
+        if extension in IMAGE_EXTENSIONS:
+            return self.iter_image_pages(file_path, start_page, stats)
+        raise UnsupportedFileTypeError(f"Unsupported file type: {extension}")
+
+    def iter_text_pages(self, file_path: str, start_page: int = 0,
+                        stats: Optional[PageStats] = None) -> Iterator[Tuple[int, List[str]]]:
+        with open(file_path, encoding='utf-8', errors='replace') as file:
+            text = file.read()
+        yield from self._paginate(chunk_paragraphs(split_paragraphs(text)), start_page, stats)
+
+    def iter_docx_pages(self, file_path: str, start_page: int = 0,
+                        stats: Optional[PageStats] = None) -> Iterator[Tuple[int, List[str]]]:
+        """Reads paragraph text straight from the document XML (no OCR, no python-docx)."""
+        import zipfile
+        from xml.etree import ElementTree
+
+        namespace = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+        try:
+            with zipfile.ZipFile(file_path) as archive:
+                root = ElementTree.fromstring(archive.read('word/document.xml'))
+        except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as e:
+            raise UnsupportedFileTypeError(f"Invalid docx file: {str(e)}")
+        # Tabs and line breaks are separate elements between runs; without
+        # whitespace for them the words on either side would run together.
+        separators = {f'{namespace}tab': ' ', f'{namespace}br': '\n', f'{namespace}cr': '\n'}
+        paragraphs = []
+        for paragraph in root.iter(f'{namespace}p'):
+            parts = []
+            for node in paragraph.iter():
+                if node.tag == f'{namespace}t':
+                    parts.append(node.text or '')
+                elif node.tag in separators:
+                    parts.append(separators[node.tag])
+            text = ''.join(parts).strip()
+            if text:
+                paragraphs.append(text)
+        yield from self._paginate(chunk_paragraphs(paragraphs), start_page, stats)
+
+    def _paginate(self, chunks: List[str], start_page: int,
+                  stats: Optional[PageStats]) -> Iterator[Tuple[int, List[str]]]:
+        # Formats without pages are cut into fixed-size pseudo-pages so the
+        # ingest checkpoint still has a resume point.
+        stats = stats or PageStats()
+        for page_number, i in enumerate(range(0, len(chunks), TEXT_CHUNKS_PER_PAGE)):
+            if page_number >= start_page:
+                stats.pages += 1
+                stats.native_text_pages += 1
+                yield page_number, chunks[i:i + TEXT_CHUNKS_PER_PAGE]
+
+    def iter_image_pages(self, file_path: str, start_page: int = 0,
+                         stats: Optional[PageStats] = None) -> Iterator[Tuple[int, List[str]]]:
+        """OCR image files directly, one page per frame (multi-page TIFF)."""
+        from PIL import Image, ImageSequence
+        stats = stats or PageStats()
+        try:
+            with Image.open(file_path) as image:
+                for page_number, frame in enumerate(ImageSequence.Iterator(image)):
+                    if page_number >= start_page:
+                        stats.pages += 1
+                        yield page_number, self.ocr_deduplicated(lambda: frame, stats)
+        except Exception as e:
+            raise Exception(
+                f"Error extracting text from image using EasyOCR: {str(e)}")
+
+    def iter_pdf_pages(self, file_path: str, start_page: int = 0,
+                       stats: Optional[PageStats] = None) -> Iterator[Tuple[int, List[str]]]:
+        """Use each page's text layer when it has one; OCR only scanned pages."""
+        import pypdfium2
+        stats = stats or PageStats()
+        try:
+            pdf_document = pypdfium2.PdfDocument(file_path)
+            for page_number in range(start_page, len(pdf_document)):
+                page = pdf_document[page_number]
+                stats.pages += 1
+                text = page.get_textpage().get_text_range()
+                if len(''.join(text.split())) >= NATIVE_TEXT_MIN_CHARS:
+                    stats.native_text_pages += 1
+                    yield page_number, split_paragraphs(text)
+                else:
+                    yield page_number, self.ocr_pdf_page(page, stats)
+        except Exception as e:
+            raise Exception(
+                f"Error extracting text from PDF: {str(e)}")
 
     def validate_pdf(self, file_path: str) -> None:
         if not os.path.exists(file_path):
@@ -53,6 +227,7 @@ class DocumentRetrieval:
         if not file_path.lower().endswith('.pdf'):
             raise PDFProcessingError("File must be a PDF")
 
+        import PyPDF2
         try:
             with open(file_path, 'rb') as file:
                 reader = PyPDF2.PdfReader(file)
@@ -61,8 +236,9 @@ class DocumentRetrieval:
         except PyPDF2.PdfReadError as e:
             raise PDFProcessingError(f"Invalid PDF file: {str(e)}")
 
-    def preprocess_image(self, image: Image) -> Image:
+    def preprocess_image(self, image: "Image.Image") -> "Image.Image":
         """Preprocess the image to improve OCR accuracy."""
+        from PIL import ImageEnhance, ImageFilter
         # Convert to grayscale
         image = image.convert('L')
         # Enhance contrast
@@ -73,6 +249,7 @@ class DocumentRetrieval:
         return image
 
     def extract_text(self, file_path: str) -> List[str]:
+        import PyPDF2
         try:
             with open(file_path, 'rb') as file:
                 reader = PyPDF2.PdfReader(file)
@@ -106,37 +283,58 @@ class DocumentRetrieval:
     #     except Exception as e:
     #         raise PDFProcessingError(f"Error extracting text from PDF: {str(e)}")
 
-    def extract_text_with_easyocr(self, file_path: str) -> List[str]:
-        """Extract text from PDF using EasyOCR, replacing Poppler with pdfium + Pillow."""
-        try:
-            paragraphs = []
-            pdf_document = pypdfium2.PdfDocument(file_path)  # Load PDF
-
-            for page_number in range(len(pdf_document)):
-                page = pdf_document[page_number]  # Get page
-                # Convert to NumPy array
-                bitmap = page.render(scale=3).to_numpy()
+    def ocr_pdf_page(self, page, stats: Optional[PageStats] = None) -> List[str]:
+        """Render a pypdfium2 page at 3x and OCR it, unless it is blank or already seen."""
+        from PIL import Image
 
-                # Convert to Pillow image (PIL) for further processing
-                image = Image.fromarray(bitmap)
+        def render(scale: float) -> "Image.Image":
+            # Convert to NumPy array, then to a Pillow image (PIL) for further processing
+            return Image.fromarray(page.render(scale=scale).to_numpy())
 
-                # Convert to NumPy array for EasyOCR
-                image_np = np.array(image)
-                results = self.reader.readtext(image_np)
-                page_text = " ".join([result[1] for result in results])
-
-                if page_text:
-                    page_paragraphs = [p.strip()
-                                       for p in page_text.split('\n\n') if p.strip()]
-                    paragraphs.extend(page_paragraphs)
+        return self.ocr_deduplicated(
+            lambda: render(3), stats,
+            render_preview=lambda: render(PREVIEW_WIDTH / page.get_width()))
 
+    def ocr_deduplicated(self, render: Callable[[], "Image.Image"], stats: Optional[PageStats] = None,
+                         render_preview: Optional[Callable[[], "Image.Image"]] = None) -> List[str]:
+        """
+        OCR the page `render` returns unless it is blank or a rescan of a page
+        OCRed before. Both are first judged on a preview of about 100 dpi
+        (`render_preview`, or the page itself): blank pages are never rendered
+        in full, and reuse is confirmed against the full render before the
+        earlier page's text is returned.
+        """
+        stats = stats or PageStats()
+        if not self.ocr_dedup:
+            stats.ocr_pages += 1
+            return self.ocr_image(render())
+        preview = (render_preview or render)()
+        if is_blank_page(preview):
+            stats.blank_pages += 1
+            return []
+        page = PageFingerprint(preview, render)
+        paragraphs = self.ocr_cache.get(page)
+        if paragraphs is not None:
+            stats.reused_ocr_pages += 1
             return paragraphs
-        except Exception as e:
-            raise Exception(
-                f"Error extracting text from PDF using EasyOCR: {str(e)}")
+        paragraphs = self.ocr_image(page.image)
+        stats.ocr_pages += 1
+        self.ocr_cache.put(page, paragraphs)
+        return paragraphs
+
+    def ocr_image(self, image: "Image.Image") -> List[str]:
+        """OCR a Pillow image with EasyOCR and split it into paragraphs."""
+        import numpy as np
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        # Convert to NumPy array for EasyOCR
+        results = self.reader.readtext(np.array(image))
+        page_text = " ".join([result[1] for result in results])
+        return [p.strip() for p in page_text.split('\n\n') if p.strip()]
 
-    def process_image_with_ocr(self, image: Image) -> List[str]:
+    def process_image_with_ocr(self, image: "Image.Image") -> List[str]:
         """Process a single image with OCR."""
+        import pytesseract
         try:
             # Preprocess the image
             image = self.preprocess_image(image)
@@ -149,7 +347,8 @@ class DocumentRetrieval:
             print(f"OCR processing error: {str(e)}")
             return []
 
-    def convert_pdf_page_to_image(self, file_path: str, page_num: int) -> Image:
+    def convert_pdf_page_to_image(self, file_path: str, page_num: int) -> "Image.Image":
+        from pdf2image import convert_from_path
         images = convert_from_path(
             file_path, first_page=page_num+1, last_page=page_num+1, dpi=300)
         return images[0]
@@ -159,25 +358,6 @@ class DocumentRetrieval:
         entities = [(ent.text, ent.label_) for ent in doc.ents]
         return entities
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-    def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
-        try:
-            embeddings = []
-            batch_size = 100
-            for i in range(0, len(texts), batch_size):
-                batch = texts[i:i + batch_size]
-                openai_client = get_openai_client()
-                response = openai_client.embeddings.create(
-                    input=batch,
-                    model="text-embedding-ada-002"
-                )
-                batch_embeddings = [item.embedding for item in response.data]
-                embeddings.extend(batch_embeddings)
-            return embeddings
-        except Exception as e:
-            raise EmbeddingGenerationError(
-                f"Error generating embeddings: {str(e)}")
-
     def validate_metadata(self, metadata: Metadata) -> None:
         if not metadata['document_id']:
             raise MetadataValidationError("document_id is required")
@@ -186,15 +366,21 @@ class DocumentRetrieval:
             raise MetadataValidationError("date_uploaded is required")
 
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-    def upsert_to_pinecone(self, texts: List[str], embeddings: List[List[float]], metadata: Metadata) -> None:
+    def upsert_to_pinecone(self, texts: List[str], embeddings: Sequence[Sequence[float]], metadata: Metadata,
+                           paragraph_ids: Optional[List[int]] = None) -> None:
         try:
+            if paragraph_ids is None:
+                paragraph_ids = list(range(len(texts)))
             vectors = []
-            for i, (text, embedding) in enumerate(zip(texts, embeddings)):
+            for i, text, embedding in zip(paragraph_ids, texts, embeddings):
                 vector_metadata = {
                     **metadata,
                     "text": text,
                     "paragraph_id": i
                 }
+                if hasattr(embedding, "tolist"):
+                    # float32 rows from the ingest pipeline
+                    embedding = embedding.tolist()
                 vectors.append({
                     "id": f"{metadata['document_id']}_p{i}",
                     "values": embedding,
@@ -227,3 +413,9 @@ class DocumentRetrieval:
     #         raise e
     #     except Exception as e:
     #         raise Exception(f"Unexpected error during indexing: {str(e)}")
+
+
+@lru_cache(maxsize=None)
+def get_document_retrieval() -> DocumentRetrieval:
+    """Process-wide DocumentRetrieval, so OCR/NLP models load once per worker."""
+    return DocumentRetrieval()
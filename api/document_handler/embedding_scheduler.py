@@ -0,0 +1,281 @@
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from typing import List, Optional, Tuple
+import openai
+from common.config import get_openai_client
+from common.deadline import Deadline, DeadlineExceeded
+from document_handler.exceptions import EmbeddingGenerationError
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Hard limits of the embeddings endpoint.
+MAX_INPUTS_PER_REQUEST = 2048
+MAX_TOKENS_PER_INPUT = 8191
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter for a requests-per-minute and a tokens-per-minute
+    budget, shared by every thread dispatching embedding requests.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.requests_per_minute,
+                             self._requests + elapsed * self.requests_per_minute / 60)
+        self._tokens = min(self.tokens_per_minute,
+                           self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def acquire(self, tokens: int, timeout: Optional[float] = None) -> None:
+        """
+        Block until one request carrying `tokens` tokens fits the budget, or
+        raise DeadlineExceeded after `timeout` seconds.
+        """
+        # A batch larger than the whole per-minute budget can never fit; let it
+        # through once the bucket is full rather than waiting forever.
+        tokens = min(tokens, self.tokens_per_minute)
+        give_up_at = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self._requests >= 1 and self._tokens >= tokens:
+                        self._requests -= 1
+                        self._tokens -= tokens
+                        return
+                    wait = max(
+                        (1 - self._requests) * 60 / self.requests_per_minute,
+                        (tokens - self._tokens) * 60 / self.tokens_per_minute,
+                    )
+            if give_up_at is not None:
+                if now + wait > give_up_at:
+                    raise DeadlineExceeded("Embedding rate limit budget exhausted")
+            time.sleep(max(wait, 0.01))
+
+    def pause(self, seconds: float) -> None:
+        """Hold back all dispatches for `seconds` (server backoff hint)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+def _load_tokenizer(model: str):
+    # Required: a character-count estimate undercounts digits and non-English
+    # text, which overruns the tokens-per-minute budget and causes 429s.
+    try:
+        import tiktoken
+    except ImportError as e:
+        raise ImportError(
+            "tiktoken is required to size embedding batches by token count "
+            "(pip install -r requirements.txt)") from e
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """Parse OpenAI reset durations such as "20ms", "1.5s" or "6m0s"."""
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Extract the server's backoff hint from an OpenAI API error, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0)
+            except (TypeError, ValueError):
+                pass
+
+    resets = [_parse_duration(headers.get(name) or "")
+              for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.RateLimitError, openai.APITimeoutError,
+                          openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class EmbeddingScheduler:
+    """
+    Embeds texts in token-sized batches dispatched concurrently under
+    requests-per-minute and tokens-per-minute budgets.
+
+    Each batch is retried on its own, so a transient failure never re-embeds
+    batches that already succeeded. Rate-limit responses pause every
+    dispatcher for as long as the server asks.
+    """
+
+    def __init__(self, model: str = EMBEDDING_MODEL,
+                 requests_per_minute: int = 3000,
+                 tokens_per_minute: int = 1_000_000,
+                 max_concurrency: int = 8,
+                 max_batch_tokens: int = 50_000,
+                 max_attempts: int = 6,
+                 max_backoff: float = 60.0,
+                 tokenizer=None):
+        self.model = model
+        self.max_batch_tokens = max_batch_tokens
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="embedding")
+        self._tokenizer = tokenizer
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            # Retries are handled per batch here, not inside the client.
+            self._client = get_openai_client().with_options(max_retries=0)
+        return self._client
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            self._tokenizer = _load_tokenizer(self.model)
+        return self._tokenizer
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, disallowed_special=()))
+
+    def make_batches(self, texts: List[str]) -> List[Tuple[int, int, int]]:
+        """Split texts into (start, end, token_count) spans by token budget."""
+        batches = []
+        start, tokens = 0, 0
+        for i, text in enumerate(texts):
+            text_tokens = min(self.count_tokens(text), MAX_TOKENS_PER_INPUT)
+            if i > start and (tokens + text_tokens > self.max_batch_tokens
+                              or i - start >= MAX_INPUTS_PER_REQUEST):
+                batches.append((start, i, tokens))
+                start, tokens = i, 0
+            tokens += text_tokens
+        if start < len(texts):
+            batches.append((start, len(texts), tokens))
+        return batches
+
+    def embed(self, texts: List[str], deadline: Optional[Deadline] = None) -> List[List[float]]:
+        """
+        With a deadline, waiting, request timeouts and retries all stop when
+        it expires (DeadlineExceeded). A single-batch request then runs in the
+        calling thread, so interactive queries never queue behind ingestion.
+        """
+        if not texts:
+            return []
+        batches = self.make_batches(texts)
+        if deadline is not None and len(batches) == 1:
+            return self._embed_batch(texts, batches[0][2], deadline)
+        futures = [self._executor.submit(self._embed_batch, texts[start:end], tokens, deadline)
+                   for start, end, tokens in batches]
+        embeddings = []
+        for future in futures:
+            embeddings.extend(future.result())
+        return embeddings
+
+    def embed_array(self, texts: List[str]):
+        """Like embed(), but packed into a compact (len(texts), dim) float32 array."""
+        import numpy as np
+
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        batches = self.make_batches(texts)
+        futures = [self._executor.submit(self._embed_batch, texts[start:end], tokens)
+                   for start, end, tokens in batches]
+        array = None
+        for (start, end, _), future in zip(batches, futures):
+            batch_embeddings = future.result()
+            if array is None:
+                array = np.empty(
+                    (len(texts), len(batch_embeddings[0])), dtype=np.float32)
+            array[start:end] = batch_embeddings
+        return array
+
+    def _embed_batch(self, batch: List[str], tokens: int,
+                     deadline: Optional[Deadline] = None) -> List[List[float]]:
+        for attempt in range(1, self.max_attempts + 1):
+            client = self.client
+            if deadline is not None:
+                self.limiter.acquire(tokens, timeout=deadline.remaining())
+                deadline.check("embedding request")
+                client = client.with_options(timeout=deadline.remaining())
+            else:
+                self.limiter.acquire(tokens)
+            try:
+                response = client.embeddings.create(
+                    input=batch, model=self.model)
+                return [item.embedding for item in response.data]
+            except Exception as e:
+                if not is_retryable(e) or attempt == self.max_attempts:
+                    raise EmbeddingGenerationError(
+                        f"Error generating embeddings: {str(e)}")
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    delay = random.uniform(0, min(self.max_backoff, 2 ** attempt))
+                else:
+                    delay = min(delay, self.max_backoff)
+                if deadline is not None and delay >= deadline.remaining():
+                    raise DeadlineExceeded(
+                        f"Embedding retry would exceed the deadline: {str(e)}")
+                print(f"Embedding batch failed (attempt {attempt}/{self.max_attempts}), "
+                      f"retrying in {delay:.2f}s: {str(e)}")
+                if isinstance(e, openai.RateLimitError):
+                    # acquire() holds back this and every other dispatcher.
+                    self.limiter.pause(delay)
+                else:
+                    time.sleep(delay)
+
+
+@lru_cache(maxsize=None)
+def get_embedding_scheduler() -> EmbeddingScheduler:
+    """Process-wide scheduler, so all requests share one rate-limit budget."""
+    return EmbeddingScheduler(
+        requests_per_minute=int(os.environ.get("EMBEDDING_RPM", 3000)),
+        tokens_per_minute=int(os.environ.get("EMBEDDING_TPM", 1_000_000)),
+        max_concurrency=int(os.environ.get("EMBEDDING_MAX_CONCURRENCY", 8)),
+        max_batch_tokens=int(os.environ.get("EMBEDDING_MAX_BATCH_TOKENS", 50_000)),
+    )
@@ -21,3 +21,8 @@ class EmbeddingGenerationError(Exception):
 class PineconeUpsertError(Exception):
     """Custom exception for Pinecone upsert errors."""
     pass
+
+
+class UnsupportedFileTypeError(Exception):
+    """Custom exception for uploads in a format that cannot be indexed."""
+    pass
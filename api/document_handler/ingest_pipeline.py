@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import re
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Callable, Deque, Iterator, List, Optional, Tuple, TYPE_CHECKING
+from document_handler.embedding_scheduler import get_embedding_scheduler
+from models.metadata import Metadata
+
+if TYPE_CHECKING:
+    from document_handler.document_retrieval import DocumentRetrieval
+
+# Yields (page_number, paragraphs) starting at the given page number.
+PageSource = Callable[[str, int], Iterator[Tuple[int, List[str]]]]
+
+
+@dataclass
+class IngestCheckpoint:
+    """Progress of one document: every paragraph of pages < pages_done is upserted."""
+    document_id: str
+    fingerprint: str
+    pages_done: int = 0
+    next_paragraph_id: int = 0
+
+
+class CheckpointStore:
+    """Stores one JSON checkpoint file per document."""
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or os.environ.get(
+            "INGEST_CHECKPOINT_DIR", "/tmp/rapt_checkpoints")
+
+    def _path(self, document_id: str) -> str:
+        safe_id = re.sub(r"[^A-Za-z0-9._-]", "_", document_id)
+        return os.path.join(self.directory, f"{safe_id}.json")
+
+    def load(self, document_id: str, fingerprint: str) -> IngestCheckpoint:
+        """Returns the saved checkpoint, or a fresh one if the file changed."""
+        try:
+            with open(self._path(document_id)) as f:
+                checkpoint = IngestCheckpoint(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            checkpoint = None
+        if checkpoint is None or checkpoint.fingerprint != fingerprint:
+            return IngestCheckpoint(document_id=document_id, fingerprint=fingerprint)
+        return checkpoint
+
+    def save(self, checkpoint: IngestCheckpoint) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(checkpoint.document_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(asdict(checkpoint), f)
+        os.replace(tmp_path, path)
+
+    def clear(self, document_id: str) -> None:
+        try:
+            os.remove(self._path(document_id))
+        except FileNotFoundError:
+            pass
+
+
+def file_fingerprint(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestPipeline:
+    """
+    Streams pages through embedding and upsert in bounded batches.
+
+    Paragraphs are grouped into batches of about `batch_size` (cut on page
+    boundaries), embedded into float32 arrays and upserted, with up to
+    `max_inflight` batches in flight. The checkpoint advances as batches
+    complete in page order, so a restarted ingest of the same file skips the
+    pages that are already indexed, including their OCR.
+    """
+
+    def __init__(self, retrieval: "DocumentRetrieval", batch_size: int = 100,
+                 max_inflight: int = 4, store: Optional[CheckpointStore] = None):
+        self.retrieval = retrieval
+        self.batch_size = batch_size
+        self.max_inflight = max_inflight
+        self.store = store or CheckpointStore()
+
+    def run(self, file_path: str, metadata: Metadata, pages: PageSource) -> int:
+        """Indexes the file and returns the total number of paragraphs indexed."""
+        checkpoint = self.store.load(
+            metadata['document_id'], file_fingerprint(file_path))
+        if checkpoint.pages_done:
+            print(f"Resuming {checkpoint.document_id} at page {checkpoint.pages_done} "
+                  f"({checkpoint.next_paragraph_id} paragraphs already indexed)")
+
+        next_id = checkpoint.next_paragraph_id
+        pages_seen = checkpoint.pages_done
+        pending_ids: List[int] = []
+        pending_texts: List[str] = []
+        # (future, pages_done, next_paragraph_id) in submission order
+        inflight: Deque[Tuple[Future, int, int]] = deque()
+
+        with ThreadPoolExecutor(max_workers=self.max_inflight,
+                                thread_name_prefix="ingest") as executor:
+            try:
+                for page_number, paragraphs in pages(file_path, checkpoint.pages_done):
+                    pages_seen = page_number + 1
+                    for paragraph in paragraphs:
+                        entities = self.retrieval.perform_ner(paragraph)
+                        print(f"Entities in paragraph: {entities}")
+                        pending_ids.append(next_id)
+                        pending_texts.append(paragraph)
+                        next_id += 1
+
+                    if len(pending_texts) >= self.batch_size:
+                        while len(inflight) >= self.max_inflight:
+                            self._complete(inflight, checkpoint, wait=True)
+                        future = executor.submit(
+                            self._process_batch, pending_ids, pending_texts, metadata)
+                        inflight.append((future, pages_seen, next_id))
+                        pending_ids, pending_texts = [], []
+                    elif not pending_texts and not inflight:
+                        # Nothing outstanding: pages without text still count.
+                        self._advance(checkpoint, pages_seen, next_id)
+
+                    self._complete(inflight, checkpoint, wait=False)
+
+                if pending_texts:
+                    future = executor.submit(
+                        self._process_batch, pending_ids, pending_texts, metadata)
+                    inflight.append((future, pages_seen, next_id))
+                while inflight:
+                    self._complete(inflight, checkpoint, wait=True)
+            except BaseException:
+                # Drop batches that haven't started, then checkpoint the ones
+                # that completed in order before the failure so a resume
+                # doesn't redo them.
+                for future, _, _ in inflight:
+                    future.cancel()
+                self._drain(inflight, checkpoint)
+                raise
+
+        self.store.clear(checkpoint.document_id)
+        return next_id
+
+    def _process_batch(self, paragraph_ids: List[int], texts: List[str], metadata: Metadata) -> None:
+        embeddings = get_embedding_scheduler().embed_array(texts)
+        self.retrieval.upsert_to_pinecone(
+            texts, embeddings, metadata, paragraph_ids=paragraph_ids)
+
+    def _complete(self, inflight: Deque[Tuple[Future, int, int]],
+                  checkpoint: IngestCheckpoint, wait: bool) -> None:
+        """Checkpoints finished batches from the front of the queue."""
+        while inflight and (wait or inflight[0][0].done()):
+            future, pages_done, next_id = inflight[0]
+            # A failed batch stays at the front so nothing after it is
+            # checkpointed.
+            future.result()
+            inflight.popleft()
+            self._advance(checkpoint, pages_done, next_id)
+            wait = False
+
+    def _drain(self, inflight: Deque[Tuple[Future, int, int]],
+               checkpoint: IngestCheckpoint) -> None:
+        """Checkpoints batches up to the first that failed or never ran."""
+        for future, pages_done, next_id in inflight:
+            if future.cancelled() or future.exception() is not None:
+                break
+            self._advance(checkpoint, pages_done, next_id)
+
+    def _advance(self, checkpoint: IngestCheckpoint, pages_done: int, next_id: int) -> None:
+        checkpoint.pages_done = pages_done
+        checkpoint.next_paragraph_id = next_id
+        self.store.save(checkpoint)
@@ -0,0 +1,76 @@
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List
+
+_TOKEN = re.compile(r"\w+")
+
+
+def _tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.casefold())
+
+
+class LexicalIndex:
+    """
+    In-memory BM25 index over passages recently returned by Pinecone.
+
+    Used as the local fallback when vector retrieval misses its deadline:
+    popular documents stay in it, so degraded answers are still grounded.
+    Holds at most `max_passages`, evicting the least recently retrieved.
+    """
+
+    def __init__(self, max_passages: int = 5000, k1: float = 1.5, b: float = 0.75):
+        self.max_passages = max_passages
+        self.k1 = k1
+        self.b = b
+        self._passages: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._terms: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+
+    def add(self, matches: List[Dict[str, Any]]) -> None:
+        """Adds Pinecone matches (id, metadata with text)."""
+        with self._lock:
+            for match in matches:
+                metadata = match["metadata"] or {}
+                text = metadata.get("text")
+                if not text:
+                    continue
+                self._passages[match["id"]] = dict(metadata)
+                self._passages.move_to_end(match["id"])
+                self._terms[match["id"]] = Counter(_tokenize(text))
+            while len(self._passages) > self.max_passages:
+                passage_id, _ = self._passages.popitem(last=False)
+                del self._terms[passage_id]
+
+    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        """Returns matches shaped like Pinecone's, scored in (0, 1]."""
+        query_terms = set(_tokenize(query))
+        with self._lock:
+            if not query_terms or not self._terms:
+                return []
+            count = len(self._terms)
+            average_length = sum(sum(terms.values()) for terms in self._terms.values()) / count
+            document_frequency = {
+                term: sum(1 for terms in self._terms.values() if term in terms)
+                for term in query_terms}
+            scores = []
+            for passage_id, terms in self._terms.items():
+                length = sum(terms.values())
+                score = 0.0
+                for term in query_terms:
+                    frequency = terms.get(term, 0)
+                    if not frequency:
+                        continue
+                    idf = math.log(1 + (count - document_frequency[term] + 0.5)
+                                   / (document_frequency[term] + 0.5))
+                    score += idf * frequency * (self.k1 + 1) / (
+                        frequency + self.k1 * (1 - self.b + self.b * length / average_length))
+                if score > 0:
+                    scores.append((score, passage_id))
+            scores.sort(reverse=True)
+            top = scores[:top_k]
+            best = top[0][0] if top else 1.0
+            return [{"id": passage_id, "metadata": dict(self._passages[passage_id]),
+                     "score": score / best}
+                    for score, passage_id in top]
@@ -8,3 +8,17 @@ class IndexingResult:
     success: bool
     paragraphs_indexed: int
     error_message: Optional[str] = None
+
+
+@dataclass
+class PageStats:
+    """How each page of an ingested document got its text"""
+    pages: int = 0
+    native_text_pages: int = 0
+    ocr_pages: int = 0
+    blank_pages: int = 0
+    reused_ocr_pages: int = 0
+
+    @property
+    def skipped_ocr_pages(self) -> int:
+        return self.blank_pages + self.reused_ocr_pages
@@ -0,0 +1,229 @@
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+    from PIL import Image
+
+# Pixels this many grey levels darker than the page background are ink.
+INK_THRESHOLD = 48
+# Blankness and the page hash are judged on a preview of about 100 dpi for a
+# letter or A4 page, where one short line of 10pt text is a few hundred ink
+# pixels and one digit about 20.
+PREVIEW_WIDTH = 850
+MIN_INK_PIXELS = 12
+# Pages whose 8x8 average hashes differ in at most this many bits are
+# candidates for reuse; the closest few are confirmed at full detail.
+HASH_SIZE = 8
+MAX_HASH_DISTANCE = 8
+MAX_CANDIDATES = 4
+# Candidates are confirmed at about 200 dpi, where a changed digit is a few
+# hundred pixels. Pixels at least STRONG_INK_THRESHOLD below the background
+# are certainly ink, those WEAK_INK_THRESHOLD below may be (glyph edges,
+# faint toner): a difference counts only where one page certainly has ink
+# and the other has none.
+CONFIRM_WIDTH = 1700
+STRONG_INK_THRESHOLD = 96
+WEAK_INK_THRESHOLD = 24
+# Largest misalignment between two scans of a page, in confirmation pixels.
+MAX_SHIFT = 8
+
+
+def _ink_mask(image: "Image.Image", threshold: int = INK_THRESHOLD) -> "np.ndarray":
+    import numpy as np
+
+    pixels = np.asarray(image.convert("L"), dtype=np.int16)
+    if pixels.size == 0:
+        return np.zeros(pixels.shape, dtype=bool)
+    background = int(np.median(pixels))
+    return pixels < background - threshold
+
+
+def _despeckle(ink: "np.ndarray") -> "np.ndarray":
+    """Drops ink pixels with fewer than two inked neighbours (scanner specks)."""
+    import numpy as np
+
+    padded = np.pad(ink, 1).astype(np.uint8)
+    height, width = ink.shape
+    neighbours = sum(padded[dy:dy + height, dx:dx + width]
+                     for dy in range(3) for dx in range(3)) - ink
+    return ink & (neighbours >= 2)
+
+
+def _resize_to_width(image: "Image.Image", width: int) -> "Image.Image":
+    from PIL import Image
+
+    height = max(round(image.height * width / max(image.width, 1)), 1)
+    return image.convert("L").resize((width, height), Image.BOX)
+
+
+def page_preview(image: "Image.Image") -> "Image.Image":
+    """The page in greyscale, reduced to about 100 dpi if it is larger."""
+    if image.width > PREVIEW_WIDTH:
+        return _resize_to_width(image, PREVIEW_WIDTH)
+    return image.convert("L")
+
+
+def is_blank_page(image: "Image.Image", min_ink_pixels: int = MIN_INK_PIXELS) -> bool:
+    """
+    A page is blank when fewer than `min_ink_pixels` ink pixels remain at
+    about 100 dpi once isolated specks are removed. Paper tint and light
+    scanner noise are ignored; a single short line of text is not.
+    """
+    return int(_despeckle(_ink_mask(page_preview(image))).sum()) < min_ink_pixels
+
+
+def average_hash(image: "Image.Image") -> int:
+    """
+    64-bit perceptual hash: which cells of an 8x8 grid over the page are
+    darker than average. Scanner noise and small shifts flip few bits.
+    """
+    import numpy as np
+    from PIL import Image
+
+    cells = np.asarray(page_preview(image).resize((HASH_SIZE, HASH_SIZE), Image.BOX),
+                       dtype=np.float32)
+    bits = (cells < cells.mean()).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def _erode(mask: "np.ndarray", size: int) -> "np.ndarray":
+    """Keeps pixels whose whole size x size block (down and right) is set."""
+    import numpy as np
+
+    height, width = mask.shape
+    padded = np.pad(mask, ((0, size - 1), (0, size - 1)))
+    eroded = np.ones_like(mask)
+    for dy in range(size):
+        for dx in range(size):
+            eroded &= padded[dy:dy + height, dx:dx + width]
+    return eroded
+
+
+def _offset(a: "np.ndarray", b: "np.ndarray", axis: int) -> int:
+    """Shift of b along the other axis that best lines its ink profile up with a's."""
+    import numpy as np
+
+    profile_a = a.sum(axis=axis).astype(np.float64)
+    profile_b = b.sum(axis=axis).astype(np.float64)
+    scores = [float(profile_a @ np.roll(profile_b, shift))
+              for shift in range(-MAX_SHIFT, MAX_SHIFT + 1)]
+    return int(np.argmax(scores)) - MAX_SHIFT
+
+
+def _shift(mask: "np.ndarray", dx: int, dy: int) -> "np.ndarray":
+    import numpy as np
+
+    height, width = mask.shape
+    shifted = np.zeros_like(mask)
+    shifted[max(dy, 0):height + min(dy, 0), max(dx, 0):width + min(dx, 0)] = \
+        mask[max(-dy, 0):height + min(-dy, 0), max(-dx, 0):width + min(-dx, 0)]
+    return shifted
+
+
+class PageInk:
+    """A page's ink at about 200 dpi, compressed, for confirming reuse."""
+
+    def __init__(self, image: "Image.Image"):
+        import numpy as np
+
+        image = _resize_to_width(image, CONFIRM_WIDTH)
+        strong = _despeckle(_ink_mask(image, STRONG_INK_THRESHOLD))
+        weak = _ink_mask(image, WEAK_INK_THRESHOLD)
+        self.shape: Tuple[int, int] = strong.shape
+        # About 40 KB for a page of text
+        self._masks = zlib.compress(np.packbits(np.stack([strong, weak])).tobytes(), 1)
+
+    def masks(self) -> Tuple["np.ndarray", "np.ndarray"]:
+        import numpy as np
+
+        bits = np.unpackbits(np.frombuffer(zlib.decompress(self._masks), dtype=np.uint8),
+                             count=2 * self.shape[0] * self.shape[1])
+        strong, weak = bits.astype(bool).reshape((2,) + self.shape)
+        return strong, weak
+
+    def matches(self, other: "PageInk") -> bool:
+        """
+        Same content up to scanner noise and a shift of MAX_SHIFT pixels:
+        once aligned, no 2x2 block is certainly ink on one page and paper on
+        the other. A changed digit leaves several such blocks.
+        """
+        if abs(self.shape[0] - other.shape[0]) > 2 * MAX_SHIFT:
+            return False
+        height = min(self.shape[0], other.shape[0])
+        strong_a, weak_a = (mask[:height] for mask in self.masks())
+        strong_b, weak_b = (mask[:height] for mask in other.masks())
+        dx, dy = _offset(strong_a, strong_b, 0), _offset(strong_a, strong_b, 1)
+        strong_b, weak_b = _shift(strong_b, dx, dy), _shift(weak_b, dx, dy)
+        differences = (strong_a & ~weak_b) | (strong_b & ~weak_a)
+        return not _erode(differences, 2).any()
+
+
+class PageFingerprint:
+    """
+    A page to OCR: hashed from its preview, with the full-resolution render
+    and its ink only produced when needed (a reuse candidate or OCR).
+    """
+
+    def __init__(self, preview: "Image.Image", render: Callable[[], "Image.Image"]):
+        self.hash = average_hash(preview)
+        self._render = render
+        self._image: Optional["Image.Image"] = None
+        self._ink: Optional[PageInk] = None
+
+    @property
+    def image(self) -> "Image.Image":
+        if self._image is None:
+            self._image = self._render()
+        return self._image
+
+    @property
+    def ink(self) -> PageInk:
+        if self._ink is None:
+            self._ink = PageInk(self.image)
+        return self._ink
+
+
+class OCRCache:
+    """
+    OCR results of recent pages, shared across documents.
+
+    A page reuses an entry only if their hashes are close and their ink
+    matches at full detail: rescans of the same page do, while pages that
+    differ in a single digit of a passport number or date of birth do not.
+    Least recently used entries are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, Tuple[int, PageInk, List[str]]]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def get(self, page: PageFingerprint) -> Optional[List[str]]:
+        with self._lock:
+            # Most recent first among equally close pages
+            candidates = sorted(
+                ((bin(page.hash ^ page_hash).count("1"), -entry_id, entry_id, ink, paragraphs)
+                 for entry_id, (page_hash, ink, paragraphs) in self._entries.items()),
+                key=lambda candidate: candidate[:2])
+        # Confirmation is slow next to the lookup; other pages needn't wait.
+        for distance, _, entry_id, ink, paragraphs in candidates[:MAX_CANDIDATES]:
+            if distance > MAX_HASH_DISTANCE:
+                break
+            if page.ink.matches(ink):
+                with self._lock:
+                    if entry_id in self._entries:
+                        self._entries.move_to_end(entry_id)
+                return list(paragraphs)
+        return None
+
+    def put(self, page: PageFingerprint, paragraphs: List[str]) -> None:
+        ink = page.ink
+        with self._lock:
+            self._entries[self._next_id] = (page.hash, ink, list(paragraphs))
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,92 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+from common.config import get_pinecone_index
+from common.deadline import Deadline, DeadlineExceeded, hedged_call
+from common.single_flight import SingleFlight
+from common.utils import normalize_query
+from document_handler.embedding_scheduler import get_embedding_scheduler
+from document_handler.lexical_index import LexicalIndex
+
+
+class QueryRetrieval:
+    """Query-side retrieval: embeddings and Pinecone lookups only.
+
+    Kept free of the OCR/NLP stack so that chat-serving workers never import
+    easyocr, torch, spaCy or the PDF libraries.
+    """
+
+    def __init__(self):
+        self._retrievals = SingleFlight()
+        # Pinecone queries that outlive their hedge delay are duplicated here;
+        # the slower attempt is abandoned.
+        self._hedges = ThreadPoolExecutor(max_workers=16, thread_name_prefix="retrieval")
+        self.hedge_after = float(os.environ.get("RETRIEVAL_HEDGE_AFTER_MS", 300)) / 1000
+        # Passages Pinecone returned recently, for answers when it is too slow.
+        self.local_index = LexicalIndex(
+            max_passages=int(os.environ.get("LOCAL_INDEX_SIZE", 5000)))
+
+    def query_index(self, query, top_k=5, deadline: Optional[Deadline] = None):
+        # Identical queries arriving together share one embedding call and one
+        # Pinecone lookup.
+        def rerun(matches, error):
+            # The shared lookup ran under the first caller's deadline; one
+            # that timed out is redone within ours if we have time left.
+            return isinstance(error, DeadlineExceeded) and (
+                deadline is None or not deadline.expired)
+
+        matches, _ = self._retrievals.do(
+            (normalize_query(query), top_k), self._query_index, query, top_k, deadline,
+            timeout=None if deadline is None else deadline.remaining(), rerun_shared=rerun)
+        return matches
+
+    def _query_index(self, query, top_k, deadline: Optional[Deadline] = None):
+        query_embedding = self.generate_embeddings([query], deadline)[0]
+        pinecone_index = get_pinecone_index()
+
+        if deadline is None:
+            results = pinecone_index.query(
+                vector=query_embedding, top_k=top_k, include_metadata=True)
+        else:
+            def search():
+                # Attempts abandoned by hedged_call can't be cancelled once
+                # running; the request timeout frees their worker by the
+                # deadline, and attempts that only start after it don't run.
+                deadline.check("vector search")
+                return pinecone_index.query(
+                    vector=query_embedding, top_k=top_k, include_metadata=True,
+                    _request_timeout=deadline.remaining())
+
+            results = hedged_call(self._hedges, search, timeout=deadline.remaining(),
+                                  hedge_after=self.hedge_after)
+        matches = results["matches"]
+        self.local_index.add(matches)
+        return matches
+
+    def retrieve(self, query, top_k=5, deadline: Optional[Deadline] = None
+                 ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Vector retrieval within the deadline. If it runs out of time or fails,
+        falls back to the local lexical index and says why (else None).
+        """
+        try:
+            return self.query_index(query, top_k, deadline), None
+        except DeadlineExceeded as e:
+            print(f"Vector retrieval timed out, using local index: {str(e)}")
+            reason = "retrieval_timeout"
+        except Exception as e:
+            print(f"Vector retrieval failed, using local index: {str(e)}")
+            reason = "retrieval_error"
+        return self.local_index.search(query, top_k), reason
+
+    def generate_embeddings(self, texts: List[str], deadline: Optional[Deadline] = None) -> List[List[float]]:
+        # Batching, concurrency, rate limits and per-batch retries are handled
+        # by the shared scheduler.
+        return get_embedding_scheduler().embed(texts, deadline)
+
+
+@lru_cache(maxsize=None)
+def get_query_retrieval() -> QueryRetrieval:
+    """Process-wide QueryRetrieval instance."""
+    return QueryRetrieval()
@@ -1,5 +1,6 @@
+import re
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List
 from .exceptions import MetadataValidationError
 
 
@@ -31,3 +32,29 @@ def validate_metadata(metadata: Dict[str, Any]) -> None:
     except ValueError:
         raise MetadataValidationError(
             "date_uploaded must be a valid ISO format date string")
+
+
+_BLANK_LINES = re.compile(r"\n\s*\n")
+
+
+def split_paragraphs(text: str) -> List[str]:
+    """Splits text on blank lines, normalizing Windows/old-Mac line endings."""
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return [p.strip() for p in _BLANK_LINES.split(text) if p.strip()]
+
+
+def chunk_paragraphs(paragraphs: List[str], max_chars: int = 1500) -> List[str]:
+    """
+    Merges consecutive short paragraphs (headings, list items) into chunks of
+    up to max_chars. Paragraphs longer than max_chars are kept whole.
+    """
+    chunks = []
+    current = ""
+    for paragraph in paragraphs:
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,16 @@
+"""
+Ingestion worker entry point.
+
+Serves only /index_texts/, so the OCR/NLP stack lives in these workers and
+chat workers (RAPT_ROLE=query) never load it:
+
+    uvicorn ingest_worker:app --port 8101
+"""
+from main import create_app
+
+app = create_app("ingest")
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8101)
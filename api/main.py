@@ -1,25 +1,42 @@
 import os
 import json
+import shutil
+import tempfile
 import uuid
+from dataclasses import asdict
 from datetime import datetime
-from fastapi import FastAPI, UploadFile, File, Form
-from common.utils import convert_to_pdf
-from database import lifespan
+from typing import Literal, Optional
+from fastapi import APIRouter, FastAPI, HTTPException, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
+from common.config import get_service_role
+from common.deadline import Deadline
+from database import default_usage_window, lifespan, summarize_usage
 from models.metadata import Metadata
 from models.chat_llm import ChatLLM
 from models.bot_assistant import BotAssistant
-from document_handler.document_retrieval import DocumentRetrieval
 
 
 from models.query_model import QueryRequest, QueryResponse
+from models.usage_model import UsageSummaryResponse
 
-app = FastAPI(lifespan=lifespan)
+# Endpoints are grouped by role so that a worker only mounts (and imports) what
+# it serves. The ingestion stack (OCR, NLP, PDF libraries) is imported inside
+# the ingestion endpoint and never loaded by query-only workers.
+query_router = APIRouter()
+ingest_router = APIRouter()
 
 queries = {}
 
+# Default end-to-end deadline for /query_index/ when the request sets none
+DEFAULT_QUERY_DEADLINE_MS = int(os.environ.get("QUERY_DEADLINE_MS", 20000))
 
-@app.post("/index_texts/")
+
+@ingest_router.post("/index_texts/")
 async def index_texts_endpoint(metadata: str = Form(...), file: UploadFile = File(...)):
+    from document_handler.document_retrieval import get_document_retrieval, upload_extension
+    from document_handler.exceptions import UnsupportedFileTypeError
+    from document_handler.models import PageStats
+
     # Parse the metadata string into a dictionary
     metadata_dict = json.loads(metadata)
 
@@ -30,27 +47,36 @@ async def index_texts_endpoint(metadata: str = Form(...), file: UploadFile = Fil
     metadata_obj = Metadata(**metadata_dict)
     if not metadata_obj.date_uploaded:
         metadata_obj.date_uploaded = datetime.now().isoformat()
-    # Ensure the /tmp directory exists
-    os.makedirs("/tmp", exist_ok=True)
-
-    pdf_path = f"/tmp/{file.filename}.pdf"
-    if not file.filename.lower().endswith('.pdf'):
-        convert_to_pdf(file, pdf_path)
-    else:
-        with open(pdf_path, "wb") as f:
-            f.write(await file.read())
-
-    document_retrieval = DocumentRetrieval()
-    num_indexed = document_retrieval.index_texts(
-        pdf_path, metadata_obj.model_dump())
-    return {"indexed_paragraphs": num_indexed}
-
-
-@app.post("/query_index/")
+    # Keep the upload in its own format: text, docx and images are ingested
+    # natively instead of being converted to PDF and OCRed back. Each upload
+    # gets its own file since indexing runs concurrently in the threadpool.
+    extension = upload_extension(file.filename, file.content_type)
+    with tempfile.NamedTemporaryFile(suffix=extension, delete=False) as f:
+        shutil.copyfileobj(file.file, f)
+        file_path = f.name
+
+    document_retrieval = get_document_retrieval()
+    stats = PageStats()
+    try:
+        num_indexed = await run_in_threadpool(
+            document_retrieval.index_texts, file_path, metadata_obj.model_dump(), stats)
+    except UnsupportedFileTypeError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    finally:
+        os.remove(file_path)
+    return {
+        "indexed_paragraphs": num_indexed,
+        "pages": {**asdict(stats), "skipped_ocr_pages": stats.skipped_ocr_pages},
+    }
+
+
+@query_router.post("/query_index/")
 async def query_index_endpoint(request: QueryRequest) -> QueryResponse:
     """
     Handles user queries, maintains query context across multiple interactions.
     """
+    # The deadline starts when the request arrives
+    deadline = Deadline((request.deadline_ms or DEFAULT_QUERY_DEADLINE_MS) / 1000)
     message = request.text
     temperature = request.temperature
     threshold = request.threshold
@@ -67,6 +93,7 @@ async def query_index_endpoint(request: QueryRequest) -> QueryResponse:
             ),
             verbose=True,
             threshold=threshold,
+            session_id=request.query_id,
         )
 
     print(f"Query ID: {request.query_id}")
@@ -75,10 +102,53 @@ async def query_index_endpoint(request: QueryRequest) -> QueryResponse:
     # Fetch the bot instance for the given query
     bot = queries[request.query_id]
 
-    # Generate response asynchronously
-    response = bot.run(message)
+    # Generate response in a worker thread so concurrent requests (and
+    # coalesced identical ones) don't block the event loop
+    response, degraded = await run_in_threadpool(bot.run_with_status, message, deadline)
+
+    return QueryResponse(response=response, query_id=request.query_id, degraded=degraded)
+
+
+@query_router.get("/usage/summary")
+async def usage_summary_endpoint(
+        group_by: Literal["model", "session", "time", "total"] = "model",
+        granularity: Literal["hour", "day"] = "hour",
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        model: Optional[str] = None,
+        session_id: Optional[str] = None) -> UsageSummaryResponse:
+    """
+    Token, cost and latency percentiles over a time window (UTC), read from
+    the pre-aggregated hourly/daily rollups.
+    """
+    default_start, default_end = default_usage_window(granularity)
+    start = start or default_start
+    end = end or default_end
+    try:
+        groups = await run_in_threadpool(
+            summarize_usage, group_by, start, end, granularity, model, session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return UsageSummaryResponse(group_by=group_by, granularity=granularity,
+                                start=start, end=end, groups=groups)
+
+
+def create_app(role: str = None) -> FastAPI:
+    """
+    Builds the API for a service role: "query", "ingest" or "all".
+
+    The role defaults to the RAPT_ROLE environment variable.
+    """
+    role = get_service_role(role)
+    app = FastAPI(lifespan=lifespan)
+    if role in ("all", "query"):
+        app.include_router(query_router)
+    if role in ("all", "ingest"):
+        app.include_router(ingest_router)
+    return app
+
 
-    return QueryResponse(response=response, query_id=request.query_id)
+app = create_app()
 
 
 if __name__ == "__main__":
@@ -1,7 +1,9 @@
 import datetime
 from pydantic import BaseModel
-from typing import Dict, Any, List, Tuple
-from document_handler.document_retrieval import DocumentRetrieval
+from typing import Dict, Any, List, Optional, Tuple
+from common.deadline import Deadline, DeadlineExceeded
+from common.utils import normalize_query
+from document_handler.query_retrieval import get_query_retrieval
 
 # Updated Prompt Template for Context-Aware RAG Bot
 PROMPT_TEMPLATE = """
@@ -39,24 +41,51 @@ class BotAssistant(BaseModel):
     contexts: List[Dict[str, Any]] = []
     verbose: bool = False
     threshold: float = 0.5
+    # Usage rows are attributed to this session (the query_id)
+    session_id: Optional[str] = None
+    # Share of a request deadline that retrieval may use; the LLM gets the rest
+    retrieval_budget: float = 0.3
 
     class Config:  # Use this for Pydantic V1
         arbitrary_types_allowed = True
 
-    def run(self, query: str) -> str:
-        # Log user input
-        document_retrieval = DocumentRetrieval()
-
-        # Query Pinecone or OCR-extracted text
-        matches = document_retrieval.query_index(query)
+    def run(self, query: str, deadline: Optional[Deadline] = None) -> str:
+        return self.run_with_status(query, deadline)[0]
+
+    def run_with_status(self, query: str, deadline: Optional[Deadline] = None) -> Tuple[str, Optional[str]]:
+        """
+        Answers the query and reports how the answer was degraded, if at all.
+
+        Without a deadline, every stage waits as long as it takes. With one,
+        retrieval gets `retrieval_budget` of it (falling back to the local
+        lexical index when Pinecone is too slow) and the LLM gets the rest
+        (returning a partial answer, or the best passage, when time runs out).
+        If the LLM keeps failing, the best passage is returned as well.
+        """
+        degraded = []
+        retrieval = get_query_retrieval()
+        if deadline is None:
+            # Query Pinecone or OCR-extracted text
+            matches = retrieval.query_index(query)
+        else:
+            matches, reason = retrieval.retrieve(
+                query, deadline=Deadline(deadline.budget(self.retrieval_budget)))
+            if reason:
+                degraded.append(reason)
+        # Lexical fallback scores are relative, not cosine similarities
+        threshold = 0 if degraded else self.threshold
 
         if matches:
-            top_contexts = [match["metadata"]["text"]
-                            for match in matches if match["score"] >= self.threshold]
+            top_matches = [
+                match for match in matches if match["score"] >= threshold]
+            top_contexts = [match["metadata"]["text"] for match in top_matches]
+            context_ids = tuple(match["id"] for match in top_matches)
             context_score = matches[0]["score"]
             context_thought = "The retrieved context has relevant details about the user."
         else:
+            top_matches = []
             top_contexts = ["NO CONTEXT FOUND"]
+            context_ids = ()
             context_score = 0
             context_thought = "No relevant context was found."
 
@@ -77,10 +106,38 @@ class BotAssistant(BaseModel):
             assistant_response="",
         )
 
-        # Generate response
-        response = self.llm.generate(prompt, stop=["[END]"])
+        # Generate response; concurrent identical questions over the same
+        # context and history share one LLM call.
+        coalesce_key = (normalize_query(query), context_ids, formatted_query)
+        try:
+            completion = self.llm.generate_completion(
+                prompt, stop=["[END]"], coalesce_key=coalesce_key,
+                session_id=self.session_id, deadline=deadline)
+        except DeadlineExceeded:
+            degraded.append("llm_timeout")
+            failure = "I couldn't finish an answer in time."
+        except Exception as e:
+            # Retries within the deadline didn't help (rate limited, upstream
+            # errors); answer from the retrieved context rather than fail.
+            print(f"LLM call failed, answering with the best passage: {str(e)}")
+            degraded.append("llm_error")
+            failure = "I couldn't get an answer from the language model."
+        else:
+            failure = None
+        if failure:
+            if top_matches:
+                response = (f"{failure} The most relevant passage I found is:"
+                            f"\n\n{top_contexts[0]}")
+            else:
+                response = f"{failure} Please try again."
+            return response, ",".join(degraded)
+
+        response = completion.text
+        if completion.truncated:
+            degraded.append("partial_answer")
+            response += "\n\n[Answer cut short: response time limit reached]"
 
         # Maintain query history
         self.query_history.append((query, response))
 
-        return response
+        return response, ",".join(degraded) or None
@@ -1,11 +1,40 @@
-from typing import List
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Hashable, List, NamedTuple, Optional
 from pydantic import BaseModel, Field
 from common.config import get_openai_client
+from common.deadline import Deadline, DeadlineExceeded
+from common.pricing import estimate_cost
+from common.single_flight import SingleFlight
 from database import Usage, create_usage
+from document_handler.embedding_scheduler import is_retryable, retry_after_seconds
 
 
 client = get_openai_client()
 
+# Shared by every ChatLLM so concurrent identical requests from different
+# sessions coalesce into one completion call.
+_completions = SingleFlight()
+
+# Streams consumed under a deadline; the caller stops waiting at the deadline
+# even if the connection stalls mid-stream.
+_streams = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-stream")
+
+# Streamed calls fail fast on rate limits and server errors, then are retried
+# here as long as the deadline leaves room for the backoff.
+MAX_STREAM_ATTEMPTS = 4
+MAX_STREAM_BACKOFF = 2.0
+
+
+class Completion(NamedTuple):
+    text: str
+    input_tokens: int
+    output_tokens: int
+    # True when the deadline cut the streamed answer short
+    truncated: bool = False
+
 
 class ChatLLM(BaseModel):
     model: str = 'gpt-4o'  # Default model to use
@@ -15,28 +44,173 @@ class ChatLLM(BaseModel):
         arbitrary_types_allowed = True
 
     # Method to generate a response from the model based on the provided prompt
-    def generate(self, prompt: str, stop: List[str] = None):
-        # Create a completion request to the OpenAI API with the given parameters
-        response = client.chat.completions.create(
-            model=self.model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=self.temperature,
-            stop=stop
-        )
+    def generate(self, prompt: str, stop: List[str] = None, coalesce_key: Hashable = None,
+                 session_id: str = None):
+        return self.generate_completion(
+            prompt, stop=stop, coalesce_key=coalesce_key, session_id=session_id).text
+
+    def generate_completion(self, prompt: str, stop: List[str] = None, coalesce_key: Hashable = None,
+                            session_id: str = None, deadline: Optional[Deadline] = None) -> Completion:
+        """
+        Generates a completion for the prompt.
+
+        Concurrent calls with the same model, temperature, stop sequences and
+        coalesce_key (the prompt itself by default) share one API call; each
+        caller still records its own usage row, attributed to session_id.
+
+        With a deadline the answer is streamed and whatever arrived by the
+        deadline is returned as a truncated completion; DeadlineExceeded is
+        raised (and the usage still recorded) if nothing arrived at all. Rate
+        limits and server errors are retried while the deadline allows; one
+        that persists is raised, again with its usage recorded. A
+        caller whose shared call was cut short by another caller's shorter
+        deadline makes its own call with the time it has left.
+        """
+        key = (self.model, self.temperature, tuple(stop or ()),
+               prompt if coalesce_key is None else coalesce_key)
+        started = time.perf_counter()
+        # Set when this caller makes the upstream call itself
+        upstream = []
+
+        def complete(prompt, stop):
+            upstream.append(True)
+            if deadline is None:
+                return self._complete(prompt, stop)
+            return self._complete_streaming(prompt, stop, deadline)
 
+        def rerun(completion, error):
+            # A shared call ran under its first caller's deadline. Redo it
+            # within ours if it timed out, or if it was cut short and we have
+            # more time left than we spent waiting on it.
+            if deadline is not None and deadline.expired:
+                return False
+            if isinstance(error, DeadlineExceeded):
+                return True
+            return error is None and completion.truncated and (
+                deadline is None or deadline.remaining() > time.perf_counter() - started)
+
+        try:
+            completion, coalesced = _completions.do(
+                key, complete, prompt, stop, rerun_shared=rerun,
+                timeout=None if deadline is None else deadline.remaining())
+        except DeadlineExceeded:
+            # Nothing arrived in time, but the upstream call still ran and is
+            # billed: record it with the prompt tokens estimated.
+            self._record_usage(
+                Completion(text="", input_tokens=len(prompt) // 4, output_tokens=0),
+                prompt, stop, session_id, started, coalesced=not upstream)
+            raise
+        except Exception:
+            # The API refused the call (rate limit, server error): nothing is
+            # billed, but the failed attempt and its latency are recorded.
+            self._record_usage(
+                Completion(text="", input_tokens=0, output_tokens=0),
+                prompt, stop, session_id, started, coalesced=not upstream)
+            raise
+
+        self._record_usage(completion, prompt, stop, session_id, started, coalesced)
+
+        # Return the generated completion
+        return completion
+
+    def _record_usage(self, completion: Completion, prompt: str, stop: Optional[List[str]],
+                      session_id: Optional[str], started: float, coalesced: bool) -> None:
         # Create the Usage object
         usage = Usage(
+            session_id=session_id,
+            model=self.model,
             prompt=prompt,
             temperature=self.temperature,
             stop=",".join(stop) if stop else None,
             is_openai=True,
-            response=response.choices[0].message.content,
-            input_tokens=response.usage.prompt_tokens,
-            output_tokens=response.usage.completion_tokens,
+            response=completion.text,
+            input_tokens=completion.input_tokens,
+            output_tokens=completion.output_tokens,
+            latency_ms=(time.perf_counter() - started) * 1000,
+            # Only the caller that made the upstream call pays for it
+            cost_usd=0.0 if coalesced else estimate_cost(
+                self.model, completion.input_tokens, completion.output_tokens),
+            coalesced=coalesced,
         )
 
         # Create the usage record
         create_usage(usage=usage)
 
-        # Return the generated response content
-        return response.choices[0].message.content
+    def _complete(self, prompt: str, stop: List[str] = None) -> Completion:
+        # Create a completion request to the OpenAI API with the given parameters
+        response = client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=self.temperature,
+            stop=stop
+        )
+        return Completion(text=response.choices[0].message.content,
+                          input_tokens=response.usage.prompt_tokens,
+                          output_tokens=response.usage.completion_tokens)
+
+    def _complete_streaming(self, prompt: str, stop: List[str], deadline: Deadline) -> Completion:
+        for attempt in range(1, MAX_STREAM_ATTEMPTS + 1):
+            try:
+                return self._stream(prompt, stop, deadline)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                if not is_retryable(e) or attempt == MAX_STREAM_ATTEMPTS:
+                    raise
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    delay = random.uniform(0, min(MAX_STREAM_BACKOFF, 0.25 * 2 ** attempt))
+                if delay >= deadline.remaining():
+                    raise
+                print(f"LLM call failed (attempt {attempt}/{MAX_STREAM_ATTEMPTS}), "
+                      f"retrying in {delay:.2f}s: {str(e)}")
+                time.sleep(delay)
+
+    def _stream(self, prompt: str, stop: List[str], deadline: Deadline) -> Completion:
+        parts: List[str] = []
+        usage = {}
+        errors: List[BaseException] = []
+        finished = threading.Event()
+        cancelled = threading.Event()
+
+        def consume():
+            try:
+                # Retried by _complete_streaming, within the deadline
+                stream = client.with_options(timeout=deadline.remaining(), max_retries=0) \
+                    .chat.completions.create(
+                        model=self.model,
+                        messages=[{"role": "user", "content": prompt}],
+                        temperature=self.temperature,
+                        stop=stop,
+                        stream=True,
+                        stream_options={"include_usage": True},
+                )
+                for chunk in stream:
+                    if cancelled.is_set():
+                        stream.close()
+                        break
+                    if chunk.usage:
+                        usage["input"] = chunk.usage.prompt_tokens
+                        usage["output"] = chunk.usage.completion_tokens
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                finished.set()
+
+        _streams.submit(consume)
+        truncated = not finished.wait(deadline.remaining())
+        if truncated:
+            cancelled.set()
+        text = "".join(list(parts))
+        if not text:
+            if errors and not truncated:
+                raise errors[0]
+            raise DeadlineExceeded("No answer from the LLM within the deadline")
+        # Token usage is only reported at the end of the stream; estimate it
+        # (about four characters per token) for answers cut short.
+        return Completion(text=text,
+                          input_tokens=usage.get("input", len(prompt) // 4),
+                          output_tokens=usage.get("output", len(text) // 4),
+                          truncated=truncated or bool(errors))
@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+from typing import Optional
+from pydantic import BaseModel, Field
 
 
 class QueryRequest(BaseModel):
@@ -7,8 +8,13 @@ class QueryRequest(BaseModel):
     threshold: float = 0.3
     namespace: str = "default"
     query_id: str = None
+    # End-to-end time limit for the request; defaults to QUERY_DEADLINE_MS
+    deadline_ms: Optional[int] = Field(default=None, gt=0)
 
 
 class QueryResponse(BaseModel):
     response: str
     query_id: str
+    # Why the answer was degraded to meet the deadline, e.g. "retrieval_timeout",
+    # "partial_answer" or "llm_timeout" (comma-separated); None if it was not
+    degraded: Optional[str] = None
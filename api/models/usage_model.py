@@ -0,0 +1,24 @@
+from datetime import datetime
+from typing import List, Optional
+from pydantic import BaseModel
+
+
+class UsageGroup(BaseModel):
+    key: str
+    requests: int
+    upstream_requests: int
+    input_tokens: int
+    output_tokens: int
+    cost_usd: float
+    latency_ms_avg: Optional[float] = None
+    latency_ms_p50: Optional[float] = None
+    latency_ms_p90: Optional[float] = None
+    latency_ms_p99: Optional[float] = None
+
+
+class UsageSummaryResponse(BaseModel):
+    group_by: str
+    granularity: str
+    start: datetime
+    end: datetime
+    groups: List[UsageGroup]
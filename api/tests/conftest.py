@@ -0,0 +1,21 @@
+import os
+import sys
+import pytest
+
+# Modules import each other as top-level packages (common, document_handler,
+# models), as they do when the API is run from this directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The OpenAI client is created at import time; tests replace it with fakes.
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """Points the usage database at an empty SQLite file."""
+    from sqlmodel import create_engine
+    import database
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'usage.db'}",
+                           connect_args={"check_same_thread": False})
+    monkeypatch.setattr(database, "engine", engine)
+    return engine
@@ -0,0 +1,104 @@
+import time
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import pytest
+from sqlmodel import Session, select
+import database
+from document_handler import query_retrieval
+from document_handler.query_retrieval import QueryRetrieval
+from models import chat_llm
+from models.chat_llm import ChatLLM
+
+CALLERS = 5
+
+
+class SlowIndex:
+    def __init__(self):
+        self.calls = 0
+
+    def query(self, vector, top_k, include_metadata):
+        self.calls += 1
+        time.sleep(0.2)
+        return {"matches": [{"id": "doc-1_p0", "score": 0.9, "metadata": {"text": "text"}}]}
+
+
+class SlowClient:
+    """OpenAI client answering after 0.2s with 100 prompt and 10 completion tokens."""
+
+    def __init__(self):
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, temperature, stop):
+        self.calls += 1
+        time.sleep(0.2)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="answer"))],
+            usage=SimpleNamespace(prompt_tokens=100, completion_tokens=10))
+
+
+def together(calls):
+    with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+        futures = [executor.submit(call) for call in calls]
+        return [future.result() for future in futures]
+
+
+def test_identical_queries_share_one_retrieval(monkeypatch):
+    index = SlowIndex()
+    monkeypatch.setattr(query_retrieval, "get_pinecone_index", lambda: index)
+    retrieval = QueryRetrieval()
+    embedded = []
+    monkeypatch.setattr(retrieval, "generate_embeddings",
+                        lambda texts, deadline=None: embedded.append(texts) or [[0.0]])
+
+    # Queries differing only in case and whitespace coalesce
+    queries = ["What is the passport number?", "what is the  passport number? "] * 3
+    results = together([lambda query=query: retrieval.query_index(query) for query in queries])
+
+    assert index.calls == 1
+    assert len(embedded) == 1
+    assert all(result == results[0] for result in results)
+    # Nothing is cached once the call is done
+    retrieval.query_index(queries[0])
+    assert index.calls == 2
+
+
+def test_different_queries_are_not_coalesced(monkeypatch):
+    index = SlowIndex()
+    monkeypatch.setattr(query_retrieval, "get_pinecone_index", lambda: index)
+    retrieval = QueryRetrieval()
+    monkeypatch.setattr(retrieval, "generate_embeddings", lambda texts, deadline=None: [[0.0]])
+
+    together([lambda: retrieval.query_index("passport number"),
+              lambda: retrieval.query_index("date of birth")])
+
+    assert index.calls == 2
+
+
+def test_coalesced_completions_attribute_usage_per_session(engine, monkeypatch):
+    database.create_db_and_tables()
+    client = SlowClient()
+    monkeypatch.setattr(chat_llm, "client", client)
+    llm = ChatLLM()
+
+    answers = together([
+        lambda session_id=f"s{i}": llm.generate("prompt", session_id=session_id)
+        for i in range(CALLERS)])
+
+    assert client.calls == 1
+    assert answers == ["answer"] * CALLERS
+    with Session(engine) as session:
+        rows = session.exec(select(database.Usage)).all()
+    assert sorted(row.session_id for row in rows) == [f"s{i}" for i in range(CALLERS)]
+    # Every caller records the tokens it received; only the caller that made
+    # the upstream call pays for it.
+    assert all(row.input_tokens == 100 and row.output_tokens == 10 for row in rows)
+    paid = [row for row in rows if not row.coalesced]
+    assert len(paid) == 1
+    assert paid[0].cost_usd == pytest.approx(100 * 2.5e-6 + 10 * 10e-6)
+    assert all(row.cost_usd == 0 for row in rows if row.coalesced)
+
+    now = database.utcnow()
+    summary, = database.summarize_usage("total", now - timedelta(hours=1), now, "hour")
+    assert (summary["requests"], summary["upstream_requests"]) == (CALLERS, 1)
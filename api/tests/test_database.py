@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import inspect, text
+from sqlmodel import Session, select
+import database
+from database import ALL, Usage, UsageRollup
+
+LEGACY_SCHEMA = (
+    "CREATE TABLE usage (id INTEGER PRIMARY KEY, prompt VARCHAR NOT NULL, "
+    "temperature VARCHAR NOT NULL, stop VARCHAR NOT NULL, is_openai BOOLEAN NOT NULL, "
+    "response VARCHAR NOT NULL, input_tokens VARCHAR NOT NULL, output_tokens VARCHAR NOT NULL)")
+
+
+def create_legacy_table(engine, rows=3):
+    with engine.begin() as connection:
+        connection.execute(text(LEGACY_SCHEMA))
+        for i in range(rows):
+            connection.execute(text(
+                "INSERT INTO usage (prompt, temperature, stop, is_openai, response, "
+                "input_tokens, output_tokens) VALUES (:prompt, '0.0', '', 1, 'ok', '10', '5')"),
+                {"prompt": f"prompt {i}"})
+
+
+def usage(created_at, latency_ms, model="gpt-4o", session_id="s1", **fields):
+    return Usage(created_at=created_at, model=model, session_id=session_id, prompt="p",
+                 temperature=0.0, is_openai=True, response="r", input_tokens=10,
+                 output_tokens=5, latency_ms=latency_ms, cost_usd=0.01, **fields)
+
+
+def test_migrates_legacy_rows_and_rebuilds_rollups(engine):
+    create_legacy_table(engine)
+
+    database.create_db_and_tables()
+
+    tables = inspect(engine).get_table_names()
+    assert "usage_legacy" in tables
+    with Session(engine) as session:
+        rows = session.exec(select(Usage)).all()
+        totals = session.exec(select(UsageRollup).where(
+            UsageRollup.granularity == "day", UsageRollup.model == ALL,
+            UsageRollup.session_id == ALL)).one()
+        created_at = session.execute(text("SELECT DISTINCT created_at FROM usage")).scalars().all()
+    assert [row.input_tokens for row in rows] == [10, 10, 10]
+    assert (totals.requests, totals.input_tokens, totals.output_tokens) == (3, 30, 15)
+    # Stored naive, like rows written through the ORM
+    assert len(created_at) == 1 and "+" not in created_at[0]
+
+
+def test_failed_migration_leaves_legacy_table(engine, monkeypatch):
+    create_legacy_table(engine)
+
+    def crash(session, chunk_size=10_000):
+        raise RuntimeError("crashed mid-migration")
+
+    monkeypatch.setattr(database, "_rebuild_rollups", crash)
+    with pytest.raises(RuntimeError):
+        database.migrate_usage_table()
+
+    inspector = inspect(engine)
+    assert "usage_legacy" not in inspector.get_table_names()
+    assert "created_at" not in {column["name"] for column in inspector.get_columns("usage")}
+
+    monkeypatch.undo()
+    monkeypatch.setattr(database, "engine", engine)
+    database.create_db_and_tables()
+    with Session(engine) as session:
+        assert len(session.exec(select(Usage)).all()) == 3
+
+
+def test_summary_totals_and_percentiles(engine):
+    database.create_db_and_tables()
+    hour = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+    for i in range(100):
+        database.create_usage(usage(hour + timedelta(seconds=i), latency_ms=i + 1))
+    database.create_usage(usage(hour, latency_ms=None, model="gpt-4o-mini",
+                                session_id="s2", coalesced=True))
+
+    by_model = database.summarize_usage("model", hour, hour + timedelta(hours=1), "hour")
+    assert [group["key"] for group in by_model] == ["gpt-4o", "gpt-4o-mini"]
+    gpt_4o = by_model[0]
+    assert gpt_4o["requests"] == 100
+    assert gpt_4o["input_tokens"] == 1000
+    assert gpt_4o["latency_ms_avg"] == 50.5
+    # Histogram buckets are 10% wide
+    assert 50 <= gpt_4o["latency_ms_p50"] <= 55
+    assert 90 <= gpt_4o["latency_ms_p90"] <= 99
+    assert 99 <= gpt_4o["latency_ms_p99"] <= 109
+    assert by_model[1]["upstream_requests"] == 0
+    assert by_model[1]["latency_ms_p50"] is None
+
+    total, = database.summarize_usage("total", hour, hour + timedelta(hours=1), "hour")
+    assert total["requests"] == 101
+
+
+def test_summary_matches_rebuilt_rollups(engine):
+    database.create_db_and_tables()
+    day = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for i in range(48):
+        database.create_usage(usage(day + timedelta(hours=i), latency_ms=10 * (i + 1),
+                                    session_id=f"s{i % 3}"))
+    window = (day, day + timedelta(days=2), "day")
+    incremental = database.summarize_usage("session", *window)
+
+    database.rebuild_rollups()
+
+    assert database.summarize_usage("session", *window) == incremental
+    assert [group["requests"] for group in incremental] == [16, 16, 16]
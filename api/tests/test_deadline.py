@@ -0,0 +1,76 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from common.deadline import Deadline, DeadlineExceeded, hedged_call
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        yield executor
+
+
+def test_deadline_budget_and_expiry():
+    deadline = Deadline(1.0)
+    assert deadline.budget(0.3) == pytest.approx(0.3, abs=0.01)
+    # Capped by what is left after the reserve
+    assert deadline.budget(0.9, reserve=0.5) == pytest.approx(0.5, abs=0.01)
+    deadline.check("test")
+
+    expired = Deadline(0.0)
+    assert expired.expired
+    assert expired.budget(0.5) == 0.0
+    with pytest.raises(DeadlineExceeded):
+        expired.check("test")
+
+
+def test_hedged_call_returns_fast_result(executor):
+    assert hedged_call(executor, lambda: "ok", timeout=1.0, hedge_after=0.1) == "ok"
+
+
+def test_hedged_call_hedges_a_slow_attempt(executor):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            time.sleep(0.5)
+            return "slow"
+        return "hedge"
+
+    started = time.monotonic()
+    assert hedged_call(executor, fn, timeout=2.0, hedge_after=0.05) == "hedge"
+    assert time.monotonic() - started < 0.3
+    assert len(calls) == 2
+
+
+def test_hedged_call_replaces_failed_attempt(executor):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ConnectionError("reset")
+        return "ok"
+
+    assert hedged_call(executor, fn, timeout=1.0, hedge_after=0.5) == "ok"
+
+
+def test_hedged_call_raises_last_error_when_all_attempts_fail(executor):
+    def fn():
+        raise ConnectionError("down")
+
+    with pytest.raises(ConnectionError):
+        hedged_call(executor, fn, timeout=1.0, hedge_after=0.5)
+
+
+def test_hedged_call_times_out(executor):
+    release = threading.Event()
+    started = time.monotonic()
+    try:
+        with pytest.raises(DeadlineExceeded):
+            hedged_call(executor, lambda: release.wait(5), timeout=0.1, hedge_after=0.05)
+        assert time.monotonic() - started < 0.3
+    finally:
+        release.set()
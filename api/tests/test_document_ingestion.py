@@ -0,0 +1,224 @@
+import asyncio
+import io
+import json
+import sys
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import pytest
+from fastapi import HTTPException, UploadFile
+from PIL import Image, ImageDraw, ImageFont
+import main
+from document_handler import document_retrieval
+from document_handler.document_retrieval import (
+    NATIVE_TEXT_MIN_CHARS, TEXT_CHUNKS_PER_PAGE, DocumentRetrieval, upload_extension)
+from document_handler.exceptions import UnsupportedFileTypeError
+from document_handler.models import PageStats
+
+W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+
+@pytest.fixture
+def retrieval(monkeypatch):
+    retrieval = DocumentRetrieval()
+    ocr_calls = []
+
+    def ocr_image(image):
+        ocr_calls.append(image.size)
+        return [f"ocr text {len(ocr_calls)}"]
+
+    monkeypatch.setattr(retrieval, "ocr_image", ocr_image)
+    retrieval.ocr_calls = ocr_calls
+    return retrieval
+
+
+def text_pdf(path, page_texts):
+    """Writes a PDF with one line of Helvetica text (a text layer) per page."""
+    count = len(page_texts)
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            " ".join(f"{4 + 2 * i} 0 R" for i in range(count)), count),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(page_texts):
+        stream = f"BT /F1 24 Tf 72 700 Td ({text}) Tj ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n{body}\nendobj\n".encode()
+    xref = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    pdf += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    pdf += (f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+            f"startxref\n{xref}\n%%EOF\n").encode()
+    path.write_bytes(pdf)
+    return str(path)
+
+
+def docx(path, body):
+    document = (f'<?xml version="1.0" encoding="UTF-8"?>'
+                f'<w:document xmlns:w="{W}"><w:body>{body}</w:body></w:document>')
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("word/document.xml", document)
+    return str(path)
+
+
+def pages(retrieval, file_path, start_page=0):
+    stats = PageStats()
+    return list(retrieval.iter_pages(file_path, start_page, stats)), stats
+
+
+def test_text_is_chunked_into_pseudo_pages(retrieval, tmp_path):
+    paragraphs = [f"Paragraph {i}. " + "word " * 300 for i in range(TEXT_CHUNKS_PER_PAGE + 10)]
+    file_path = tmp_path / "notes.md"
+    file_path.write_text("\r\n\r\n".join(paragraphs))
+
+    result, stats = pages(retrieval, str(file_path))
+
+    assert [page_number for page_number, _ in result] == [0, 1]
+    assert len(result[0][1]) == TEXT_CHUNKS_PER_PAGE
+    assert result[1][1][0].startswith(f"Paragraph {TEXT_CHUNKS_PER_PAGE}.")
+    assert (stats.pages, stats.native_text_pages, stats.ocr_pages) == (2, 2, 0)
+    # Resuming skips the pages already indexed
+    assert [page_number for page_number, _ in pages(retrieval, str(file_path), 1)[0]] == [1]
+
+
+def test_short_paragraphs_are_merged(retrieval, tmp_path):
+    file_path = tmp_path / "notes.txt"
+    file_path.write_text("Heading\n\nFirst item\n\n\nSecond item")
+
+    assert pages(retrieval, str(file_path))[0] == [
+        (0, ["Heading\n\nFirst item\n\nSecond item"])]
+
+
+def test_docx_text_keeps_tabs_and_breaks_between_runs(retrieval, tmp_path):
+    file_path = docx(tmp_path / "form.docx", (
+        "<w:p><w:r><w:t>Name:</w:t></w:r><w:r><w:tab/><w:t>Jane Doe</w:t></w:r></w:p>"
+        "<w:p><w:r><w:t xml:space='preserve'>Passport </w:t></w:r>"
+        "<w:r><w:t>K1234567</w:t><w:br/><w:t>Issued 2020</w:t></w:r></w:p>"
+        "<w:p><w:r><w:t>  </w:t></w:r></w:p>"))
+
+    (page_number, chunks), = pages(retrieval, file_path)[0]
+
+    assert chunks == ["Name: Jane Doe\n\nPassport K1234567\nIssued 2020"]
+    assert retrieval.ocr_calls == []
+
+
+def test_invalid_docx_is_unsupported(retrieval, tmp_path):
+    file_path = tmp_path / "broken.docx"
+    file_path.write_bytes(b"not a zip file")
+
+    with pytest.raises(UnsupportedFileTypeError):
+        pages(retrieval, str(file_path))
+
+
+def test_pdf_uses_text_layer_and_ocrs_only_short_pages(retrieval, tmp_path):
+    long_text = "Passport number K1234567 issued 2020"
+    short_text = "x" * (NATIVE_TEXT_MIN_CHARS - 1)
+    file_path = text_pdf(tmp_path / "mixed.pdf", [long_text, short_text])
+
+    result, stats = pages(retrieval, file_path)
+
+    assert result == [(0, [long_text]), (1, ["ocr text 1"])]
+    assert (stats.native_text_pages, stats.ocr_pages) == (1, 1)
+    # The OCRed page was rendered at 3x
+    assert retrieval.ocr_calls == [(1836, 2376)]
+
+
+def test_blank_pdf_pages_are_only_rendered_as_previews(retrieval, tmp_path, monkeypatch):
+    import pypdfium2
+    scales = []
+    render = pypdfium2.PdfPage.render
+
+    def recording_render(page, scale=1, **kwargs):
+        scales.append(scale)
+        return render(page, scale=scale, **kwargs)
+
+    monkeypatch.setattr(pypdfium2.PdfPage, "render", recording_render)
+    file_path = text_pdf(tmp_path / "blank.pdf", [""])
+
+    result, stats = pages(retrieval, file_path)
+
+    assert result == [(0, [])]
+    assert (stats.blank_pages, stats.ocr_pages) == (1, 0)
+    assert scales == [pytest.approx(850 / 612)]
+
+
+def test_images_are_ocred(retrieval, tmp_path):
+    image = Image.new("L", (850, 1100), 255)
+    ImageDraw.Draw(image).text((100, 100), "Invoice 42", fill=0,
+                               font=ImageFont.load_default(size=30))
+    file_path = tmp_path / "scan.gif"
+    image.save(file_path)
+
+    result, stats = pages(retrieval, str(file_path))
+
+    assert result == [(0, ["ocr text 1"])]
+    assert stats.ocr_pages == 1
+
+
+@pytest.mark.parametrize("filename, content_type, expected", [
+    ("report.PDF", "application/octet-stream", ".pdf"),
+    ("notes.txt", "application/octet-stream", ".txt"),
+    ("scan", "image/jpeg", ".jpg"),
+    ("scan.gif", "image/gif", ".gif"),
+    ("scan.heic", "image/x-unknown", ".png"),
+    ("notes", "text/plain; charset=utf-8", ".txt"),
+    ("", None, ""),
+    ("archive.zip", "application/zip", ".zip"),
+])
+def test_upload_extension(filename, content_type, expected):
+    assert upload_extension(filename, content_type) == expected
+
+
+def upload(filename, content, content_type=None):
+    headers = {"content-type": content_type} if content_type else None
+    return UploadFile(io.BytesIO(content), filename=filename, headers=headers)
+
+
+@pytest.mark.parametrize("filename", ["archive.zip", "", "no_extension"])
+def test_unsupported_upload_is_rejected_with_415(filename):
+    metadata = json.dumps({"document_id": "doc-1", "date_uploaded": "2024-01-01"})
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.index_texts_endpoint(metadata, upload(filename, b"data")))
+
+    assert error.value.status_code == 415
+
+
+def test_image_upload_without_extension_is_indexed(retrieval, monkeypatch):
+    monkeypatch.setattr(document_retrieval, "get_document_retrieval", lambda: retrieval)
+    indexed = []
+    monkeypatch.setattr(retrieval, "index_texts",
+                        lambda file_path, metadata, stats: indexed.append(file_path) or 1)
+    metadata = json.dumps({"document_id": "doc-1", "date_uploaded": "2024-01-01"})
+
+    result = asyncio.run(main.index_texts_endpoint(
+        metadata, upload("scan", b"GIF89a", "image/gif")))
+
+    assert result["indexed_paragraphs"] == 1
+    assert indexed[0].endswith(".gif")
+
+
+def test_models_load_once_under_concurrent_first_use(monkeypatch):
+    loads = []
+
+    def load(name):
+        loads.append(name)
+        time.sleep(0.1)
+        return object()
+
+    monkeypatch.setitem(sys.modules, "spacy", SimpleNamespace(load=load))
+    retrieval = DocumentRetrieval()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        models = list(executor.map(lambda _: retrieval.nlp, range(4)))
+
+    assert loads == ["en_core_web_sm"]
+    assert all(model is models[0] for model in models)
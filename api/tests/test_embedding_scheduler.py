@@ -0,0 +1,162 @@
+import sys
+import threading
+import time
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import httpx
+import openai
+import pytest
+from common.deadline import Deadline, DeadlineExceeded
+from document_handler.embedding_scheduler import (
+    MAX_INPUTS_PER_REQUEST, EmbeddingScheduler, RateLimiter, retry_after_seconds)
+from document_handler.exceptions import EmbeddingGenerationError
+
+
+class WordTokenizer:
+    """One token per word."""
+
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+
+def api_error(error_class, status_code, headers=None):
+    request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+    response = httpx.Response(status_code, headers=headers or {}, request=request)
+    return error_class("error", response=response, body=None)
+
+
+class FakeClient:
+    """Embeds each text as [len(text)]; `failures` maps a text to errors to raise first."""
+
+    def __init__(self, failures=None):
+        self.failures = failures or {}
+        self.batches = []
+        self._lock = threading.Lock()
+        self.embeddings = SimpleNamespace(create=self.create)
+
+    def with_options(self, **options):
+        return self
+
+    def create(self, input, model):
+        with self._lock:
+            self.batches.append(list(input))
+            errors = self.failures.get(input[0])
+            if errors:
+                raise errors.pop(0)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[float(len(text))])
+                                     for text in input])
+
+
+def scheduler(client, **options):
+    scheduler = EmbeddingScheduler(tokenizer=WordTokenizer(), **options)
+    scheduler._client = client
+    return scheduler
+
+
+def test_rate_limiter_passes_within_budget():
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=1000)
+    started = time.monotonic()
+    for _ in range(5):
+        limiter.acquire(100)
+    assert time.monotonic() - started < 0.05
+
+
+def test_rate_limiter_waits_for_tokens_to_refill():
+    # 6000 tokens per minute refill 100 tokens per second
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=6000)
+    limiter.acquire(6000)
+    started = time.monotonic()
+    limiter.acquire(20)
+    assert 0.15 <= time.monotonic() - started < 0.5
+
+
+def test_rate_limiter_gives_up_at_timeout():
+    limiter = RateLimiter(requests_per_minute=1, tokens_per_minute=1000)
+    limiter.acquire(1)
+    with pytest.raises(DeadlineExceeded):
+        limiter.acquire(1, timeout=0.1)
+
+
+def test_rate_limiter_pause_holds_back_dispatches():
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=6000)
+    limiter.pause(0.2)
+    started = time.monotonic()
+    limiter.acquire(1)
+    assert time.monotonic() - started >= 0.19
+
+
+def test_make_batches_by_token_budget():
+    texts = ["one two three"] * 5
+    assert scheduler(FakeClient(), max_batch_tokens=7).make_batches(texts) == [
+        (0, 2, 6), (2, 4, 6), (4, 5, 3)]
+
+
+def test_make_batches_caps_inputs_per_request():
+    texts = ["word"] * (MAX_INPUTS_PER_REQUEST + 1)
+    batches = scheduler(FakeClient()).make_batches(texts)
+    assert [(start, end) for start, end, _ in batches] == [
+        (0, MAX_INPUTS_PER_REQUEST), (MAX_INPUTS_PER_REQUEST, MAX_INPUTS_PER_REQUEST + 1)]
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"retry-after-ms": "250"}, 0.25),
+    ({"retry-after": "2"}, 2.0),
+    ({"retry-after-ms": "250", "retry-after": "2"}, 0.25),
+    ({"x-ratelimit-reset-requests": "20ms", "x-ratelimit-reset-tokens": "6m0s"}, 360.0),
+    ({"x-ratelimit-reset-tokens": "1.5s"}, 1.5),
+    ({}, None),
+])
+def test_retry_after_seconds(headers, expected):
+    error = api_error(openai.RateLimitError, 429, headers)
+    assert retry_after_seconds(error) == expected
+
+
+def test_retry_after_seconds_http_date():
+    when = datetime.now(timezone.utc) + timedelta(seconds=30)
+    error = api_error(openai.RateLimitError, 429, {"retry-after": format_datetime(when, usegmt=True)})
+    assert 28 <= retry_after_seconds(error) <= 30
+
+
+def test_only_the_failed_batch_is_retried():
+    client = FakeClient(failures={
+        "c1": [api_error(openai.RateLimitError, 429, {"retry-after-ms": "50"})]})
+    texts = ["a1", "a2", "b1", "b2", "c1", "c2"]
+
+    embeddings = scheduler(client, max_batch_tokens=2).embed(texts)
+
+    assert embeddings == [[2.0]] * 6
+    assert sorted(map(tuple, client.batches)) == [
+        ("a1", "a2"), ("b1", "b2"), ("c1", "c2"), ("c1", "c2")]
+
+
+def test_server_errors_are_retried():
+    client = FakeClient(failures={"a": [api_error(openai.InternalServerError, 500)]})
+    assert scheduler(client, max_backoff=0.05).embed(["a"]) == [[1.0]]
+    assert len(client.batches) == 2
+
+
+def test_client_errors_are_not_retried():
+    client = FakeClient(failures={"a": [api_error(openai.BadRequestError, 400)]})
+    with pytest.raises(EmbeddingGenerationError):
+        scheduler(client).embed(["a"])
+    assert len(client.batches) == 1
+
+
+def test_retry_that_would_miss_the_deadline_gives_up():
+    client = FakeClient(failures={
+        "a": [api_error(openai.RateLimitError, 429, {"retry-after": "5"})]})
+    with pytest.raises(DeadlineExceeded):
+        scheduler(client).embed(["a"], deadline=Deadline(1.0))
+
+
+def test_embed_array_is_float32_in_input_order():
+    array = scheduler(FakeClient(), max_batch_tokens=1).embed_array(["a", "bb", "ccc"])
+    assert array.dtype == "float32"
+    assert array.tolist() == [[1.0], [2.0], [3.0]]
+
+
+def test_missing_tiktoken_fails_loudly(monkeypatch):
+    monkeypatch.setitem(sys.modules, "tiktoken", None)
+    with pytest.raises(ImportError, match="tiktoken is required"):
+        EmbeddingScheduler().count_tokens("text")
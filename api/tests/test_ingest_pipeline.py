@@ -0,0 +1,100 @@
+import time
+import numpy as np
+import pytest
+from document_handler import ingest_pipeline
+from document_handler.ingest_pipeline import CheckpointStore, IngestPipeline
+
+PAGES = 40
+PARAGRAPHS_PER_PAGE = 3
+
+
+class FakeScheduler:
+    def embed_array(self, texts):
+        return np.zeros((len(texts), 4), dtype=np.float32)
+
+
+class FakeRetrieval:
+    def __init__(self):
+        self.upserted = []
+
+    def perform_ner(self, text):
+        return []
+
+    def upsert_to_pinecone(self, texts, embeddings, metadata, paragraph_ids=None):
+        # Slow enough that batches are still in flight when a page fails
+        time.sleep(0.05)
+        self.upserted.extend(paragraph_ids)
+
+
+def make_pages(fail_at=None):
+    pages_read = []
+
+    def pages(file_path, start_page):
+        for page_number in range(start_page, PAGES):
+            if page_number == fail_at:
+                raise RuntimeError(f"OCR failed on page {page_number}")
+            pages_read.append(page_number)
+            yield page_number, [f"page {page_number} paragraph {i}"
+                                for i in range(PARAGRAPHS_PER_PAGE)]
+
+    return pages, pages_read
+
+
+@pytest.fixture
+def document(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest_pipeline, "get_embedding_scheduler", FakeScheduler)
+    file_path = tmp_path / "document.pdf"
+    file_path.write_bytes(b"%PDF-1.4 test")
+    return str(file_path), {"document_id": "doc-1", "date_uploaded": "2024-01-01"}
+
+
+def test_failure_checkpoints_completed_batches(tmp_path, document):
+    file_path, metadata = document
+    store = CheckpointStore(str(tmp_path / "checkpoints"))
+    retrieval = FakeRetrieval()
+    pages, _ = make_pages(fail_at=17)
+
+    with pytest.raises(RuntimeError):
+        IngestPipeline(retrieval, batch_size=10, store=store).run(file_path, metadata, pages)
+
+    checkpoint = store.load("doc-1", ingest_pipeline.file_fingerprint(file_path))
+    assert checkpoint.pages_done > 1
+    assert checkpoint.next_paragraph_id == checkpoint.pages_done * PARAGRAPHS_PER_PAGE
+    assert set(range(checkpoint.next_paragraph_id)) <= set(retrieval.upserted)
+
+
+def test_resume_after_failure_skips_indexed_pages(tmp_path, document):
+    file_path, metadata = document
+    store = CheckpointStore(str(tmp_path / "checkpoints"))
+    retrieval = FakeRetrieval()
+    failing_pages, _ = make_pages(fail_at=17)
+    with pytest.raises(RuntimeError):
+        IngestPipeline(retrieval, batch_size=10, store=store).run(file_path, metadata, failing_pages)
+    pages_done = store.load("doc-1", ingest_pipeline.file_fingerprint(file_path)).pages_done
+
+    pages, pages_read = make_pages()
+    total = IngestPipeline(retrieval, batch_size=10, store=store).run(file_path, metadata, pages)
+
+    assert total == PAGES * PARAGRAPHS_PER_PAGE
+    assert pages_read[0] == pages_done
+    assert set(retrieval.upserted) == set(range(total))
+    # Finished ingests leave no checkpoint behind.
+    assert store.load("doc-1", ingest_pipeline.file_fingerprint(file_path)).pages_done == 0
+
+
+def test_failed_batch_is_not_checkpointed(tmp_path, document):
+    file_path, metadata = document
+    store = CheckpointStore(str(tmp_path / "checkpoints"))
+
+    class FailingRetrieval(FakeRetrieval):
+        def upsert_to_pinecone(self, texts, embeddings, metadata, paragraph_ids=None):
+            if paragraph_ids[0] == 24:
+                raise RuntimeError("upsert failed")
+            super().upsert_to_pinecone(texts, embeddings, metadata, paragraph_ids)
+
+    pages, _ = make_pages()
+    with pytest.raises(RuntimeError):
+        IngestPipeline(FailingRetrieval(), batch_size=10, store=store).run(file_path, metadata, pages)
+
+    checkpoint = store.load("doc-1", ingest_pipeline.file_fingerprint(file_path))
+    assert checkpoint.next_paragraph_id <= 24
@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+from document_handler.page_fingerprint import OCRCache, PageFingerprint, is_blank_page
+
+# A letter page rendered at 3x, as pages are rendered for OCR
+PAGE_SIZE = (1836, 2376)
+# 10pt text at 216 dpi
+FONT = ImageFont.load_default(size=30)
+
+
+def page(lines=(), noise=0, seed=0, shift=(0, 0)):
+    image = Image.new("L", PAGE_SIZE, 245)
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        draw.text((150 + shift[0], 200 + 60 * i + shift[1]), line, fill=20, font=FONT)
+    if noise:
+        rng = np.random.default_rng(seed)
+        pixels = np.asarray(image, dtype=np.int16)
+        pixels += rng.integers(-noise, noise + 1, pixels.shape, dtype=np.int16)
+        # A few isolated dust specks
+        for y, x in rng.integers(0, min(PAGE_SIZE), (20, 2)):
+            pixels[y, x] = 0
+        image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    return image
+
+
+def fingerprint(image):
+    return PageFingerprint(image, lambda: image)
+
+
+FORM = ["Passport application", "Surname: Doe", "Given names: Jane"]
+PASSPORT = FORM + ["Passport number: K1234567"]
+
+
+def test_empty_and_noisy_pages_are_blank():
+    assert is_blank_page(page())
+    assert is_blank_page(page(noise=12))
+
+
+@pytest.mark.parametrize("lines", [
+    ["Signed: J. Doe 2024-01-01"],
+    ["Invoice 42", "Total due: $1,250.00"],
+    ["Page 7"],
+])
+def test_short_pages_are_not_blank(lines):
+    assert not is_blank_page(page(lines))
+    assert not is_blank_page(page(lines, noise=12))
+
+
+def test_identical_pages_share_ocr():
+    cache = OCRCache()
+    cache.put(fingerprint(page(PASSPORT)), ["first"])
+
+    assert cache.get(fingerprint(page(PASSPORT))) == ["first"]
+
+
+@pytest.mark.parametrize("noise, seed, shift", [
+    (12, 1, (0, 0)),
+    (12, 2, (1, 0)),
+    (20, 3, (2, 1)),
+    (8, 4, (-1, 2)),
+    (20, 5, (0, -2)),
+])
+def test_rescans_with_noise_and_small_shifts_share_ocr(noise, seed, shift):
+    cache = OCRCache()
+    cache.put(fingerprint(page(PASSPORT, noise=8, seed=0)), ["first"])
+
+    assert cache.get(fingerprint(page(PASSPORT, noise=noise, seed=seed, shift=shift))) == ["first"]
+
+
+@pytest.mark.parametrize("lines", [
+    FORM + ["Passport number: K1234587"],
+    FORM + ["Passport number: K7234567"],
+    FORM + ["Passport number: K1234567."],
+    FORM + ["Date of birth: 1990-01-02"],
+])
+@pytest.mark.parametrize("noise, shift", [(0, (0, 0)), (12, (1, 2)), (20, (2, -1))])
+def test_changed_content_is_not_reused(lines, noise, shift):
+    cache = OCRCache()
+    cache.put(fingerprint(page(PASSPORT, noise=8, seed=0)), ["first"])
+
+    assert cache.get(fingerprint(page(lines, noise=noise, seed=7, shift=shift))) is None
+
+
+def test_lookup_renders_only_for_candidates():
+    cache = OCRCache()
+    cache.put(fingerprint(page(PASSPORT)), ["first"])
+    renders = []
+
+    def render():
+        renders.append(True)
+        return page(["A completely different page"] * 30)
+
+    preview = render()
+    renders.clear()
+    assert cache.get(PageFingerprint(preview, render)) is None
+    # The hashes are too far apart to need the full render
+    assert renders == []
+
+
+def test_cache_evicts_least_recently_used():
+    cache = OCRCache(max_entries=2)
+    pages = {name: page(FORM + [f"Passport number: {name}"]) for name in ("K1", "K2", "K3")}
+    for name in ("K1", "K2"):
+        cache.put(fingerprint(pages[name]), [name])
+    cache.get(fingerprint(pages["K1"]))
+    cache.put(fingerprint(pages["K3"]), ["K3"])
+
+    assert cache.get(fingerprint(pages["K2"])) is None
+    assert cache.get(fingerprint(pages["K1"])) == ["K1"]
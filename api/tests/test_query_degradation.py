@@ -0,0 +1,246 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import httpx
+import openai
+import pytest
+from sqlmodel import Session, select
+import database
+from common.deadline import Deadline, DeadlineExceeded
+from document_handler import query_retrieval
+from document_handler.query_retrieval import QueryRetrieval
+from models import bot_assistant, chat_llm
+from models.bot_assistant import BotAssistant
+from models.chat_llm import ChatLLM
+
+MATCHES = [{"id": "doc-1_p0", "score": 0.9,
+            "metadata": {"text": "The passport number is K1234567."}}]
+
+
+class FakeIndex:
+    """Pinecone index answering after `delay` seconds."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    def query(self, vector, top_k, include_metadata, _request_timeout=None):
+        self.calls.append(_request_timeout)
+        time.sleep(self.delay)
+        return {"matches": MATCHES}
+
+
+class FakeStream:
+    def __init__(self, words, delay, first_delay):
+        self.words = words
+        self.delay = delay
+        self.first_delay = first_delay
+
+    def __iter__(self):
+        time.sleep(self.first_delay)
+        for word in self.words:
+            yield SimpleNamespace(usage=None, choices=[
+                SimpleNamespace(delta=SimpleNamespace(content=word + " "))])
+            time.sleep(self.delay)
+        yield SimpleNamespace(choices=[], usage=SimpleNamespace(
+            prompt_tokens=100, completion_tokens=len(self.words)))
+
+    def close(self):
+        pass
+
+
+def api_error(error_class, status_code, headers=None):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(status_code, headers=headers or {}, request=request)
+    return error_class("error", response=response, body=None)
+
+
+class FakeClient:
+    """OpenAI client streaming `words`, one every `delay` seconds, after raising `errors`."""
+
+    def __init__(self, words=("The", "passport", "number", "is", "K1234567."),
+                 delay=0.1, first_delay=0.0, errors=()):
+        self.words = words
+        self.delay = delay
+        self.first_delay = first_delay
+        self.errors = list(errors)
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def with_options(self, **options):
+        return self
+
+    def create(self, stream=False, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return FakeStream(self.words, self.delay, self.first_delay)
+
+
+@pytest.fixture
+def retrieval(monkeypatch):
+    retrieval = QueryRetrieval()
+    retrieval.hedge_after = 0.05
+    monkeypatch.setattr(retrieval, "generate_embeddings",
+                        lambda texts, deadline=None: [[0.0] * 4 for _ in texts])
+    return retrieval
+
+
+@pytest.fixture
+def usage_rows(engine):
+    database.create_db_and_tables()
+
+    def rows():
+        with Session(engine) as session:
+            return session.exec(select(database.Usage)).all()
+    return rows
+
+
+def run_together(callers):
+    with ThreadPoolExecutor(max_workers=len(callers)) as executor:
+        leader = executor.submit(callers[0])
+        time.sleep(0.02)
+        followers = [executor.submit(caller) for caller in callers[1:]]
+        return [future.exception() or future.result() for future in [leader] + followers]
+
+
+def test_slow_vector_search_falls_back_to_local_index(retrieval, monkeypatch):
+    index = FakeIndex()
+    monkeypatch.setattr(query_retrieval, "get_pinecone_index", lambda: index)
+    assert retrieval.retrieve("passport number", deadline=Deadline(1.0)) == (MATCHES, None)
+
+    index.delay = 0.5
+    started = time.monotonic()
+    matches, reason = retrieval.retrieve("passport number", deadline=Deadline(0.2))
+
+    assert time.monotonic() - started < 0.35
+    assert reason == "retrieval_timeout"
+    assert [match["id"] for match in matches] == ["doc-1_p0"]
+    # Every attempt was bounded by the deadline
+    assert all(timeout is not None and timeout <= 0.2 for timeout in index.calls[1:])
+
+
+def test_short_deadline_does_not_fail_coalesced_retrieval(retrieval, monkeypatch):
+    monkeypatch.setattr(query_retrieval, "get_pinecone_index", lambda: FakeIndex(delay=0.3))
+
+    short, long = run_together([
+        lambda: retrieval.query_index("passport number", deadline=Deadline(0.1)),
+        lambda: retrieval.query_index("passport number", deadline=Deadline(10)),
+    ])
+
+    assert isinstance(short, DeadlineExceeded)
+    assert long == MATCHES
+
+
+def test_short_deadline_does_not_truncate_coalesced_answer(usage_rows, monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(chat_llm, "client", client)
+    llm = ChatLLM()
+
+    short, long = run_together([
+        lambda: llm.generate_completion("prompt", session_id="a", deadline=Deadline(0.15)),
+        lambda: llm.generate_completion("prompt", session_id="b", deadline=Deadline(10)),
+    ])
+
+    assert short.truncated
+    assert not long.truncated
+    assert long.text == "The passport number is K1234567. "
+    assert client.calls == 2
+    assert {row.session_id: row.coalesced for row in usage_rows()} == {"a": False, "b": False}
+
+
+def test_llm_timeout_still_records_usage(usage_rows, monkeypatch):
+    monkeypatch.setattr(chat_llm, "client", FakeClient(first_delay=1.0))
+
+    with pytest.raises(DeadlineExceeded):
+        ChatLLM().generate_completion("x" * 400, session_id="a", deadline=Deadline(0.1))
+
+    row, = usage_rows()
+    assert row.response == ""
+    assert row.input_tokens == 100
+    assert row.cost_usd > 0
+    assert 100 <= row.latency_ms < 200
+
+
+def test_llm_rate_limit_is_retried_within_deadline(usage_rows, monkeypatch):
+    client = FakeClient(delay=0.0, errors=[
+        api_error(openai.RateLimitError, 429, {"retry-after-ms": "50"}),
+        api_error(openai.InternalServerError, 503)])
+    monkeypatch.setattr(chat_llm, "client", client)
+
+    completion = ChatLLM().generate_completion("prompt", session_id="a", deadline=Deadline(2.0))
+
+    assert completion.text == "The passport number is K1234567. "
+    assert client.calls == 3
+    row, = usage_rows()
+    assert row.output_tokens == 5
+
+
+def test_llm_error_still_records_usage(usage_rows, monkeypatch):
+    client = FakeClient(errors=[api_error(openai.InternalServerError, 500)] * 10)
+    monkeypatch.setattr(chat_llm, "client", client)
+
+    with pytest.raises(openai.InternalServerError):
+        ChatLLM().generate_completion("prompt", session_id="a", deadline=Deadline(5.0))
+
+    assert client.calls == chat_llm.MAX_STREAM_ATTEMPTS
+    row, = usage_rows()
+    assert (row.response, row.input_tokens, row.cost_usd) == ("", 0, 0.0)
+
+
+def test_llm_retry_after_beyond_deadline_is_not_awaited(usage_rows, monkeypatch):
+    client = FakeClient(errors=[api_error(openai.RateLimitError, 429, {"retry-after": "30"})])
+    monkeypatch.setattr(chat_llm, "client", client)
+
+    started = time.monotonic()
+    with pytest.raises(openai.RateLimitError):
+        ChatLLM().generate_completion("prompt", session_id="a", deadline=Deadline(1.0))
+
+    assert time.monotonic() - started < 0.2
+    assert client.calls == 1
+
+
+def test_bot_degrades_when_llm_keeps_failing(usage_rows, retrieval, monkeypatch):
+    monkeypatch.setattr(query_retrieval, "get_pinecone_index", lambda: FakeIndex())
+    monkeypatch.setattr(bot_assistant, "get_query_retrieval", lambda: retrieval)
+    monkeypatch.setattr(chat_llm, "client", FakeClient(
+        errors=[api_error(openai.RateLimitError, 429, {"retry-after": "30"})]))
+    bot = BotAssistant(llm=ChatLLM(), session_id="a")
+
+    response, degraded = bot.run_with_status("What is the passport number?", Deadline(0.5))
+
+    assert degraded == "llm_error"
+    assert "K1234567" in response
+    assert bot.query_history == []
+    assert len(usage_rows()) == 1
+
+
+def test_bot_degrades_when_every_stage_is_slow(usage_rows, retrieval, monkeypatch):
+    monkeypatch.setattr(query_retrieval, "get_pinecone_index", lambda: FakeIndex())
+    retrieval.query_index("passport number")
+    monkeypatch.setattr(query_retrieval, "get_pinecone_index", lambda: FakeIndex(delay=1.0))
+    monkeypatch.setattr(bot_assistant, "get_query_retrieval", lambda: retrieval)
+    monkeypatch.setattr(chat_llm, "client", FakeClient(first_delay=1.0))
+    bot = BotAssistant(llm=ChatLLM(), session_id="a")
+
+    started = time.monotonic()
+    response, degraded = bot.run_with_status("What is the passport number?", Deadline(0.5))
+
+    assert time.monotonic() - started < 0.65
+    assert degraded == "retrieval_timeout,llm_timeout"
+    assert "K1234567" in response
+    assert bot.query_history == []
+
+
+def test_bot_returns_partial_answer(usage_rows, retrieval, monkeypatch):
+    monkeypatch.setattr(query_retrieval, "get_pinecone_index", lambda: FakeIndex())
+    monkeypatch.setattr(bot_assistant, "get_query_retrieval", lambda: retrieval)
+    monkeypatch.setattr(chat_llm, "client", FakeClient(delay=0.2))
+    bot = BotAssistant(llm=ChatLLM(), session_id="a")
+
+    response, degraded = bot.run_with_status("What is the passport number?", Deadline(0.5))
+
+    assert degraded == "partial_answer"
+    assert response.startswith("The passport")
+    assert "cut short" in response
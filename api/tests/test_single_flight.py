@@ -0,0 +1,90 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from common.deadline import DeadlineExceeded
+from common.single_flight import SingleFlight
+
+
+def run_together(single_flight, callers):
+    """Starts the first caller, then the rest while its call is in flight."""
+    with ThreadPoolExecutor(max_workers=len(callers)) as executor:
+        leader = executor.submit(callers[0])
+        time.sleep(0.05)
+        followers = [executor.submit(caller) for caller in callers[1:]]
+        return [future.exception() or future.result() for future in [leader] + followers]
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    single_flight = SingleFlight()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        time.sleep(0.2)
+        return "answer"
+
+    results = run_together(single_flight, [lambda: single_flight.do("key", fn)] * 5)
+
+    assert len(calls) == 1
+    assert results[0] == ("answer", False)
+    assert results[1:] == [("answer", True)] * 4
+
+
+def test_later_calls_are_not_cached():
+    single_flight = SingleFlight()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        return len(calls)
+
+    assert single_flight.do("key", fn) == (1, False)
+    assert single_flight.do("key", fn) == (2, False)
+
+
+def test_errors_are_shared():
+    single_flight = SingleFlight()
+
+    def fn():
+        time.sleep(0.2)
+        raise ConnectionError("down")
+
+    results = run_together(single_flight, [lambda: single_flight.do("key", fn)] * 3)
+
+    assert all(isinstance(result, ConnectionError) for result in results)
+
+
+def test_waiting_caller_times_out():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    threading.Timer(0.5, release.set).start()
+
+    results = run_together(single_flight, [
+        lambda: single_flight.do("key", release.wait, 5),
+        lambda: single_flight.do("key", release.wait, 5, timeout=0.1),
+    ])
+
+    assert results[0] == (True, False)
+    assert isinstance(results[1], DeadlineExceeded)
+
+
+def test_rerun_shared_runs_the_waiting_callers_own_call():
+    single_flight = SingleFlight()
+
+    def fn(budget):
+        time.sleep(0.2)
+        if budget < 1:
+            raise DeadlineExceeded("leader's budget ran out")
+        return f"answer within {budget}s"
+
+    def rerun(result, error):
+        return isinstance(error, DeadlineExceeded)
+
+    results = run_together(single_flight, [
+        lambda: single_flight.do("key", fn, 0.1, rerun_shared=rerun),
+        lambda: single_flight.do("key", fn, 10, rerun_shared=rerun),
+    ])
+
+    assert isinstance(results[0], DeadlineExceeded)
+    assert results[1] == ("answer within 10s", False)